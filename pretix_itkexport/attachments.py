@@ -0,0 +1,140 @@
+import codecs
+import csv
+import gzip
+import tempfile
+import zipfile
+
+from .exporters import LedgerLine
+from .writers import ArrowWriter
+
+
+class AttachmentPart():
+    """
+    A single (possibly compressed) attachment being written.
+
+    Content is spooled to disk when it gets large.
+    """
+
+    def __init__(self, filename, compression=None, spool_max_size=8 * 1024 * 1024):
+        self.filename = filename
+        self.compression = compression
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_max_size, mode='w+b')
+        self.archive = None
+
+        if 'gzip' == compression:
+            self.stream = gzip.GzipFile(filename=filename, mode='wb', fileobj=self.file)
+        elif 'zip' == compression:
+            self.archive = zipfile.ZipFile(self.file, mode='w', compression=zipfile.ZIP_DEFLATED)
+            self.stream = self.archive.open(filename, mode='w')
+        else:
+            self.stream = self.file
+
+        self.writer = None
+
+    def getWriter(self):
+        """
+        Get a CSV writer writing to the part.
+        """
+        if self.writer is None:
+            self.writer = csv.writer(codecs.getwriter('utf-8')(self.stream), dialect='excel', delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        return self.writer
+
+    def getSize(self):
+        """
+        Get the (approximate, due to buffering) size of the part written so far.
+        """
+        return self.file.tell()
+
+    def close(self):
+        """
+        Close the part and return its content.
+        """
+        if self.stream is not self.file:
+            self.stream.close()
+        if self.archive is not None:
+            self.archive.close()
+
+        self.file.seek(0)
+        content = self.file.read()
+        self.file.close()
+
+        return content
+
+
+class AttachmentWriter():
+    """
+    Writes export rows into (gzip or zip compressed) attachments.
+
+    If a maximum size is set, a new part is started when a part exceeds it
+    (approximately), and parts are numbered, e.g. "eventbillet-20180101-1.csv.gz".
+    The header row (if any) is repeated in each CSV part.
+
+    Parquet and Arrow files are always written as a single part.
+    """
+
+    compressions = ['gzip', 'zip']
+
+    content_types = {
+        'gzip': 'application/gzip',
+        'zip': 'application/zip',
+    }
+
+    def __init__(self, basename, output_format='csv', compression=None, max_size=None, spool_max_size=8 * 1024 * 1024):
+        if compression is not None and compression not in self.compressions:
+            raise Exception('Invalid compression: {}'.format(compression))
+
+        self.basename = basename
+        self.output_format = output_format
+        self.compression = compression
+        self.max_size = max_size
+        self.spool_max_size = spool_max_size
+
+    def write(self, data):
+        """
+        Write rows and return attachments as (filename, content, content type) tuples.
+        """
+        if 'csv' != self.output_format:
+            part = self.openPart(1, False)
+            ArrowWriter(part.stream, self.output_format).write(data)
+            return [self.getAttachment(part)]
+
+        numbered = self.max_size is not None
+        attachments = []
+        header = None
+        part = None
+        for index, row in enumerate(data):
+            if 0 == index and not isinstance(row, (LedgerLine, dict)):
+                header = row
+            if part is not None and self.max_size is not None and part.getSize() >= self.max_size:
+                attachments.append(self.getAttachment(part))
+                part = None
+            if part is None:
+                part = self.openPart(len(attachments) + 1, numbered)
+                if header is not None and row is not header:
+                    part.getWriter().writerow(header)
+            part.getWriter().writerow(row)
+
+        if part is None:
+            part = self.openPart(1, numbered)
+        attachments.append(self.getAttachment(part))
+
+        return attachments
+
+    def getFilename(self, number, numbered):
+        filename = self.basename
+        if numbered:
+            filename += '-{}'.format(number)
+        return filename + '.' + self.output_format
+
+    def openPart(self, number, numbered):
+        return AttachmentPart(self.getFilename(number, numbered), self.compression, self.spool_max_size)
+
+    def getAttachment(self, part):
+        content = part.close()
+        if 'gzip' == self.compression:
+            return (part.filename + '.gz', content, self.content_types['gzip'])
+        if 'zip' == self.compression:
+            return (part.filename[:-len(self.output_format)] + 'zip', content, self.content_types['zip'])
+        if self.output_format in ArrowWriter.content_types:
+            return (part.filename, content, ArrowWriter.content_types[self.output_format])
+        return (part.filename, content, 'text/csv')
@@ -0,0 +1,259 @@
+import json
+import locale
+import random
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import django.conf
+import pytz
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.translation import ugettext_lazy as _
+from pretix.base.models.event import Event, EventMetaProperty, EventMetaValue
+from pretix.base.models.log import LogEntry
+from pretix.base.models.orders import Order
+from pretix.base.models.organizer import Organizer
+from pretix_paymentdibs.payment import DIBS
+
+from .exporters import (
+    EventExporter, PaidOrdersGroupedExporter, PaidOrdersLineExporter,
+)
+from .models import OrderRefund
+from .rendering import RowRenderer
+
+
+class Benchmark():
+    """
+    Benchmarks exporters on synthetic events and orders.
+
+    All fixtures belong to a dedicated organizer which is deleted (with
+    everything belonging to it) when the fixtures are deleted.
+    """
+
+    organizer_slug = 'itk-export-benchmark'
+
+    # Settings used if ITK_EXPORT is not set.
+    settings = {
+        'debit_artskonto': '1000',
+        'credit_artskonto': '2000',
+        'cash_artskonto': '3000'
+    }
+
+    # (name, exporter class, exporter settings)
+    cases = [
+        ('event', EventExporter, {}),
+        ('event (columnar engine)', EventExporter, {'engine': 'columnar'}),
+        ('paid-orders', PaidOrdersLineExporter, {}),
+        ('paid-orders-grouped', PaidOrdersGroupedExporter, {}),
+        ('paid-orders-grouped (database aggregation)', PaidOrdersGroupedExporter, {'aggregation': 'database'}),
+        ('paid-orders-grouped (compact text)', PaidOrdersGroupedExporter, {'compact_text': True}),
+        ('paid-orders-grouped (pages of 1000 orders)', PaidOrdersGroupedExporter, {'page_size': 1000}),
+    ]
+
+    # Number of orders per event.
+    event_size = 100
+
+    # Share of orders paid with cash and of (DIBS) orders refunded.
+    cash_ratio = 0.1
+    refund_ratio = 0.1
+
+    def __init__(self, starttime=None, seed=42):
+        self.starttime = starttime or pytz.utc.localize(datetime(2018, 1, 1))
+        self.endtime = self.starttime + timedelta(days=365)
+        self.random = random.Random(seed)
+
+    @staticmethod
+    def parseScale(scale):
+        """
+        Parse a scale like "1k", "100k" or "1M" into a number of orders.
+        """
+        match = re.match(r'^(\d+)([kKmM]?)$', str(scale))
+        if match is None:
+            raise ValueError('Invalid scale: {}'.format(scale))
+        multiplier = {'': 1, 'k': 1000, 'm': 1000000}[match.group(2).lower()]
+        return int(match.group(1)) * multiplier
+
+    def getRandomDatetime(self):
+        return self.starttime + timedelta(seconds=self.random.randrange(int((self.endtime - self.starttime).total_seconds())))
+
+    def deleteFixtures(self):
+        organizer = Organizer.objects.filter(slug=self.organizer_slug).first()
+        if organizer is None:
+            return
+
+        orders = Order.objects.filter(event__organizer=organizer)
+        LogEntry.all.filter(content_type=ContentType.objects.get_for_model(Order), object_id__in=orders.values('pk')).delete()
+        orders.delete()
+        EventMetaValue.objects.filter(event__organizer=organizer).delete()
+        Event.objects.filter(organizer=organizer).delete()
+        EventMetaProperty.objects.filter(organizer=organizer).delete()
+        organizer.delete()
+
+    def createFixtures(self, number_of_orders, batch_size=5000):
+        self.deleteFixtures()
+
+        organizer = Organizer.objects.create(name='ITK export benchmark', slug=self.organizer_slug)
+        psp = EventMetaProperty.objects.create(organizer=organizer, name='PSP', default='')
+        audience = EventMetaProperty.objects.create(organizer=organizer, name='Audience', default='')
+
+        number_of_events = max(1, number_of_orders // self.event_size)
+        Event.objects.bulk_create([Event(organizer=organizer, name='Event {}'.format(index), slug='event-{}'.format(index),
+                                         date_from=self.getRandomDatetime()) for index in range(number_of_events)])
+        event_ids = list(Event.objects.filter(organizer=organizer).order_by('pk').values_list('pk', flat=True))
+
+        meta_values = []
+        for index, event_id in enumerate(event_ids):
+            meta_values.append(EventMetaValue(event_id=event_id, property=psp, value='XG-{:04d}-{:04d}'.format(index % 50, index)))
+            meta_values.append(EventMetaValue(event_id=event_id, property=audience, value=self.random.choice(['children', 'adults'])))
+        EventMetaValue.objects.bulk_create(meta_values, batch_size=batch_size)
+
+        for offset in range(0, number_of_orders, batch_size):
+            orders = []
+            for index in range(offset, min(offset + batch_size, number_of_orders)):
+                orders.append(self.createOrder(index, event_ids[index % number_of_events]))
+            Order.objects.bulk_create(orders)
+
+        self.createRefunds(organizer, batch_size)
+
+    def createOrder(self, index, event_id):
+        code = 'B{:07d}'.format(index)
+        payment_date = self.getRandomDatetime()
+        if self.random.random() < self.cash_ratio:
+            payment_provider = 'cash'
+            payment_info = None
+            status = Order.STATUS_PAID
+        else:
+            payment_provider = 'dibs'
+            # Mimics the data stored by the DIBS payment provider.
+            payment_info = json.dumps({
+                'orderid': code,
+                'transact': str(100000000 + index),
+                'paytype': self.random.choice(['DK', 'V-DK', 'VISA', 'MC']),
+                'cardnomask': 'XXXXXXXXXXXX{:04d}'.format(index % 10000)
+            })
+            status = Order.STATUS_REFUNDED if self.random.random() < self.refund_ratio else Order.STATUS_PAID
+
+        return Order(code=code, status=status, event_id=event_id, email='order-{}@example.com'.format(index),
+                     datetime=payment_date - timedelta(minutes=5), expires=payment_date + timedelta(days=14),
+                     payment_date=payment_date, payment_provider=payment_provider, payment_info=payment_info,
+                     total=Decimal(self.random.randrange(5000, 100000)) / 100)
+
+    def createRefunds(self, organizer, batch_size):
+        """
+        Create refund log entries (and index them) for all refunded orders.
+        """
+        content_type = ContentType.objects.get_for_model(Order)
+        orders = Order.objects.filter(event__organizer=organizer, status=Order.STATUS_REFUNDED)
+
+        # Log entry datetimes are set on creation, so we refund orders on the day after payment and update the
+        # datetime for each day.
+        refund_days = dict()
+        logentries = []
+        for order_id, event_id, payment_date in orders.values_list('pk', 'event_id', 'payment_date').iterator():
+            logentries.append(LogEntry(content_type=content_type, object_id=order_id, event_id=event_id,
+                                       action_type=OrderRefund.action_type))
+            refund_days.setdefault(payment_date.date() + timedelta(days=1), []).append(order_id)
+        LogEntry.objects.bulk_create(logentries, batch_size=batch_size)
+
+        refunds = LogEntry.objects.filter(content_type=content_type, action_type=OrderRefund.action_type,
+                                          object_id__in=orders.values('pk'))
+        # Keep the number of query parameters below SQLite's limit.
+        update_size = 500
+        for day, order_ids in refund_days.items():
+            for offset in range(0, len(order_ids), update_size):
+                refunds.filter(object_id__in=order_ids[offset:offset + update_size]) \
+                    .update(datetime=pytz.utc.localize(datetime.combine(day, datetime.min.time()) + timedelta(hours=12)))
+
+        OrderRefund.objects.filter(order__event__organizer=organizer).delete()
+        # Benchmark orders are not part of any ledger snapshots, so (real) snapshots must not be invalidated.
+        OrderRefund.index(refunds.values_list('pk', 'object_id', 'datetime').iterator(), invalidate=False)
+
+    def run(self, names=None):
+        """
+        Run exporters (all if names is None) on the benchmark orders only and
+        return timings and query counts by name.
+        """
+        results = dict()
+        settings = dict(self.settings)
+        if hasattr(django.conf.settings, 'ITK_EXPORT'):
+            settings.update(django.conf.settings.ITK_EXPORT)
+
+        with override_settings(ITK_EXPORT=settings):
+            for name, exporter_class, exporter_settings in self.cases:
+                if names is not None and name not in names:
+                    continue
+                exporter = exporter_class()
+                if 'page_size' in exporter_settings:
+                    exporter.page_size = exporter_settings['page_size']
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    rows = 0
+                    for row in exporter.getData(starttime=self.starttime, endtime=self.endtime, organizer=self.organizer_slug,
+                                                **exporter_settings):
+                        rows += 1
+                    seconds = time.perf_counter() - start
+
+                results[name] = {
+                    'seconds': seconds,
+                    'queries': len(queries),
+                    'rows': rows
+                }
+
+        return results
+
+    # Imports the itk-export command in a fresh Python process and prints the
+    # time taken (after setting up Django) and the number of modules loaded.
+    startup_script = """
+import importlib, json, sys, time
+import django
+django.setup()
+modules = len(sys.modules)
+start = time.perf_counter()
+importlib.import_module('pretix_itkexport.management.commands.itk-export')
+print(json.dumps({'seconds': time.perf_counter() - start, 'modules': len(sys.modules) - modules}))
+"""
+
+    def runStartup(self):
+        """
+        Measure the time it takes to import the itk-export command (and the
+        modules it loads on import) in a fresh process.
+
+        The process inherits the environment (including DJANGO_SETTINGS_MODULE).
+        """
+        output = subprocess.check_output([sys.executable, '-c', self.startup_script], universal_newlines=True)
+        result = json.loads(output.strip().splitlines()[-1])
+
+        return {
+            'startup (import command)': {'seconds': result['seconds'], 'queries': 0, 'rows': result['modules']},
+        }
+
+    def runRendering(self, number_of_rows=100000):
+        """
+        Compare rendering row amounts and texts using lazy translations and
+        locale.format_string with rendering using a RowRenderer.
+        """
+        amounts = [Decimal(self.random.randrange(5000, 100000)) / 100 for _index in range(number_of_rows)]
+        order_ids = [['B{:07d}'.format(index)] for index in range(number_of_rows)]
+
+        start = time.perf_counter()
+        for amount, ids in zip(amounts, order_ids):
+            locale.format_string('%.2f', amount)
+            _('Ticket sale ({card_type}): {order_ids}').format(card_type=_('credit'), order_ids=', '.join(ids))
+        lazy_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        renderer = RowRenderer()
+        for amount, ids in zip(amounts, order_ids):
+            renderer.formatAmount(amount)
+            renderer.formatText(DIBS.CARD_TYPE_CREDIT, ids)
+        renderer_seconds = time.perf_counter() - start
+
+        return {
+            'rendering (lazy translations)': {'seconds': lazy_seconds, 'queries': 0, 'rows': number_of_rows},
+            'rendering (row renderer)': {'seconds': renderer_seconds, 'queries': 0, 'rows': number_of_rows},
+        }
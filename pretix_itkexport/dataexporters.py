@@ -0,0 +1,157 @@
+import csv
+import hashlib
+import io
+from collections import OrderedDict
+from datetime import timedelta
+
+import django.conf
+from django import forms
+from django.core.files.base import ContentFile
+from django.utils import translation
+from django.utils.formats import get_format
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+from django.utils.translation import ugettext_lazy as _
+from pretix.base.exporter import BaseExporter
+from pretix.base.models import CachedFile
+
+from .models import ExportFile
+from .periods import parseDatetime, period_names, resolvePeriod
+from .rendering import AmountFormatter
+
+
+class ITKDataExporter(BaseExporter):
+    """
+    Makes an exporter (limited to the event) available in the pretix control
+    panel.
+
+    pretix runs exports as background tasks. Files generated for periods
+    that have ended are stored and reused for identical exports.
+    """
+
+    # The exporter class as a dotted path (cf. the itk-export command).
+    exporter_class = None
+
+    # Number of days a generated file is reused.
+    cache_days = 7
+
+    # Progress is reported every progress_interval rows (cf. getProgress).
+    progress_interval = 100
+    progress_rows = 1000
+
+    @property
+    def export_form_fields(self):
+        return OrderedDict([
+            ('period', forms.ChoiceField(
+                label=_('Period'),
+                choices=[('', _('Start and end date'))] + [(name, name) for name in period_names],
+                required=False
+            )),
+            ('starttime', forms.DateField(label=_('Start date'), required=False)),
+            ('endtime', forms.DateField(label=_('End date'), help_text=_('Not included in the export'), required=False)),
+        ])
+
+    def render(self, form_data):
+        settings = django.conf.settings.ITK_EXPORT.copy() if hasattr(django.conf.settings, 'ITK_EXPORT') else {}
+        settings.update(self.getPeriod(form_data))
+        settings['event_ids'] = [self.event.pk]
+
+        filename = 'eventbillet-{}-{}'.format(self.event.slug, self.identifier)
+        if 'starttime' in settings:
+            filename += '-{:%Y%m%d}'.format(settings['starttime'])
+            if 'endtime' in settings:
+                filename += '-{:%Y%m%d}'.format(settings['endtime'])
+        filename += '.csv'
+
+        # Only exports of periods that have ended are reused.
+        key = None
+        if 'endtime' in settings and settings['endtime'] <= now():
+            key = self.getCacheKey(settings)
+            export_file = ExportFile.objects.filter(key=key, cachedfile__expires__gt=now()).select_related('cachedfile').first()
+            if export_file is not None and export_file.cachedfile.file:
+                with export_file.cachedfile.file.open('rb') as f:
+                    return filename, 'text/csv', f.read()
+
+        self.reportProgress(0)
+
+        exporter = import_string(self.exporter_class)()
+        # Format amounts for the language used when exporting.
+        exporter.amount_formatter = AmountFormatter({'decimal_point': get_format('DECIMAL_SEPARATOR')})
+        data = exporter.getData(**settings)
+
+        # Cf. Command.renderContent
+        output = io.StringIO()
+        writer = csv.writer(output, dialect='excel', delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        # Orders are loaded while the rows are generated (data is lazy).
+        for index, row in enumerate(data):
+            if index > 0 and 0 == index % self.progress_interval:
+                self.reportProgress(self.getProgress(index))
+            if isinstance(row, dict):
+                # Event exports are lists of dicts.
+                if 0 == index:
+                    writer.writerow(row.keys())
+                row = row.values()
+            writer.writerow(row)
+        content = output.getvalue().encode('utf-8')
+
+        if key is not None:
+            cachedfile = CachedFile.objects.create(expires=now() + timedelta(days=self.cache_days), date=now(),
+                                                   filename=filename, type='text/csv')
+            cachedfile.file.save(filename, ContentFile(content))
+            ExportFile.objects.update_or_create(key=key, defaults={'cachedfile': cachedfile})
+
+        self.reportProgress(100)
+
+        return filename, 'text/csv', content
+
+    def getPeriod(self, form_data):
+        if form_data.get('period'):
+            starttime, endtime = resolvePeriod(form_data['period'])
+            return {'starttime': starttime, 'endtime': endtime}
+
+        period = dict()
+        for name in ['starttime', 'endtime']:
+            if form_data.get(name):
+                period[name] = parseDatetime(form_data[name])
+        return period
+
+    def getProgress(self, rows):
+        """
+        Get the progress (in percent) after writing a number of rows.
+
+        The number of rows is not known until all orders have been loaded,
+        so the progress approaches (but never reaches) 100 and is 50 after
+        writing progress_rows rows.
+        """
+        return 100 * rows // (rows + self.progress_rows)
+
+    def getCacheKey(self, settings):
+        # Texts and amounts depend on the language and the decimal separator used.
+        values = [self.identifier, self.event.pk, translation.get_language(), get_format('DECIMAL_SEPARATOR')] \
+            + [settings[name].isoformat() if name in settings else '' for name in ['starttime', 'endtime']] \
+            + [str(settings[name]) if name in settings else '' for name in ['debit_artskonto', 'credit_artskonto', 'cash_artskonto']]
+        return hashlib.sha256(repr(values).encode('utf-8')).hexdigest()
+
+    def reportProgress(self, percent):
+        # Progress reporting is only supported by some pretix versions.
+        progress_callback = getattr(self, 'progress_callback', None)
+        if progress_callback is not None:
+            progress_callback(percent)
+
+
+class ITKEventDataExporter(ITKDataExporter):
+    identifier = 'itk-event'
+    verbose_name = _('ITK export: Event')
+    exporter_class = 'pretix_itkexport.exporters.EventExporter'
+
+
+class ITKPaidOrdersDataExporter(ITKDataExporter):
+    identifier = 'itk-paid-orders'
+    verbose_name = _('ITK export: Paid orders')
+    exporter_class = 'pretix_itkexport.exporters.PaidOrdersLineExporter'
+
+
+class ITKPaidOrdersGroupedDataExporter(ITKDataExporter):
+    identifier = 'itk-paid-orders-grouped'
+    verbose_name = _('ITK export: Paid orders grouped')
+    exporter_class = 'pretix_itkexport.exporters.PaidOrdersGroupedExporter'
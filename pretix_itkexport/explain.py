@@ -0,0 +1,87 @@
+import re
+
+from django.db import connections
+
+
+class QueryExplainer():
+    """
+    Shows query plans (using EXPLAIN) and finds sequential scans of tables
+    with more than a threshold number of rows.
+
+    Supports PostgreSQL, MySQL and SQLite.
+    """
+
+    prefixes = {
+        'postgresql': 'EXPLAIN ',
+        'mysql': 'EXPLAIN ',
+        'sqlite': 'EXPLAIN QUERY PLAN ',
+    }
+
+    def __init__(self, threshold=10000):
+        # Minimum number of rows in a table for a sequential scan to be reported.
+        self.threshold = threshold
+        # Number of rows by table.
+        self.table_sizes = dict()
+
+    def explain(self, queryset):
+        """
+        Explain a queryset.
+
+        Returns the plan (lines) and the sequential scans (as (table, number of
+        rows) pairs) of tables over the threshold.
+        """
+        connection = connections[queryset.db]
+        if connection.vendor not in QueryExplainer.prefixes:
+            raise ValueError('Cannot explain queries on {}'.format(connection.vendor))
+
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(QueryExplainer.prefixes[connection.vendor] + sql, params)
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+
+        if connection.vendor == 'postgresql':
+            lines = [row[0] for row in rows]
+            tables = re.findall(r'Seq Scan on (\w+)', '\n'.join(lines))
+        elif connection.vendor == 'mysql':
+            rows = [dict(zip(columns, row)) for row in rows]
+            lines = ['  '.join('{}={}'.format(name, value) for name, value in row.items()) for row in rows]
+            tables = [row['table'] for row in rows if row['type'] == 'ALL']
+        else:
+            # (id, parent, notused, detail)
+            lines = [row[-1] for row in rows]
+            tables = [match.group(1) for match in (re.match(r'SCAN (?:TABLE )?(\w+)(?!.* USING )', line) for line in lines) if match]
+
+        scans = []
+        for table in tables:
+            size = self.getTableSize(connection, table)
+            if size is not None and size > self.threshold:
+                scans.append((table, size))
+
+        return lines, scans
+
+    def getTableSize(self, connection, table):
+        """
+        Get the (estimated) number of rows in a table (None if the table is unknown, e.g. an alias).
+        """
+        if table not in self.table_sizes:
+            self.table_sizes[table] = self.countRows(connection, table)
+
+        return self.table_sizes[table]
+
+    @staticmethod
+    def countRows(connection, table):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s AND relkind = %s', [table, 'r'])
+            elif connection.vendor == 'mysql':
+                cursor.execute('SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+                               [table])
+            elif table in connection.introspection.table_names(cursor):
+                # SQLite has no statistics, but is only used for small (development) databases.
+                cursor.execute('SELECT COUNT(*) FROM {}'.format(connection.ops.quote_name(table)))
+            else:
+                return None
+            row = cursor.fetchone()
+
+        return int(row[0]) if row is not None and row[0] is not None else None
@@ -1,20 +1,92 @@
-import locale
 import re
-from collections import defaultdict
+import threading
+from array import array
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
+from decimal import Decimal
 
 import django.conf
-from django.utils.translation import ugettext_lazy as _
-from pretix.base.models.log import LogEntry
+from django.db import transaction
+from django.db.models import (
+    Case, DateTimeField, IntegerField, OuterRef, Q, Subquery, Sum, TextField,
+    When,
+)
+from django.db.models.functions import Coalesce
+from django.db.models.query import QuerySet
+from django.utils.timezone import now
+from pretix.base.models.event import Event, EventMetaProperty, EventMetaValue
 from pretix.base.models.orders import Order
-from pretix_paymentdibs.payment import DIBS
 
-# Make Python locale aware (and use LC_ALL from environment)
-locale.setlocale(locale.LC_ALL, '')
+from .models import LedgerDay, LedgerGroup, OrderRefund
+from .pagination import iterateKeyset
+from .rendering import AmountFormatter, RowRenderer
+
+
+class PaymentInfoCache():
+    """
+    Least recently used cache of (order id, card type) by order pk.
+
+    Getting these from an order means decoding the order's DIBS payment info,
+    so we make sure to do it only once per order.
+    """
+
+    def __init__(self, maxsize=10000):
+        # Imported here to keep importing this module cheap.
+        from pretix_paymentdibs.payment import DIBS
+        self.dibs = DIBS
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, order):
+        if order.pk in self.data:
+            self.hits += 1
+            self.data.move_to_end(order.pk)
+            return self.data[order.pk]
+
+        self.misses += 1
+        card_type = self.dibs.get_payment_card_type(order) if self.dibs.identifier == order.payment_provider else None
+        value = (self.dibs.get_order_id(order), card_type)
+        self.data[order.pk] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+        return value
+
+    def getCardType(self, order):
+        """
+        Get the card type of an order without caching it (and without getting the order id).
+        """
+        return self.dibs.get_payment_card_type(order) if self.dibs.identifier == order.payment_provider else None
+
+
+class OrderCache():
+    """
+    Orders loaded once (by PaidOrdersExporter.loadOrders) for a period and
+    shared between exporters (and threads) exporting periods within it.
+    """
+
+    def __init__(self, **kwargs):
+        # The period (starttime and endtime).
+        self.period = {name: kwargs[name] for name in ['starttime', 'endtime'] if name in kwargs}
+        self.lock = threading.Lock()
+        self.orders = None
+
+    def get(self, exporter):
+        with self.lock:
+            if self.orders is None:
+                self.orders = list(exporter.iterate(exporter.loadOrders(**self.period)))
+
+        return exporter.prefetchEventMetaData(self.orders)
 
 
 class Exporter():
     settings = dict()
 
+    # Number of orders read before loading meta data for their events (cf. streamEventMetaData).
+    event_meta_data_batch_size = 1000
+
     # banken skal debiteres.
     debit_artskonto = None
 
@@ -38,6 +110,35 @@ class Exporter():
         self.credit_artskonto = self.settings['credit_artskonto']
         self.cash_artskonto = self.settings['cash_artskonto']
 
+        # Event meta data indexed by event id.
+        self.event_meta_data = dict()
+
+        # Profiler (cf. pretix_itkexport.profiling.Profiler) used when profiling.
+        self.profiler = None
+
+        # Orders shared with other exporters (cf. OrderCache).
+        self.order_cache = None
+
+        # Amount formatter (cf. pretix_itkexport.rendering.AmountFormatter) used
+        # instead of formatting amounts using the current locale.
+        self.amount_formatter = None
+
+        # Number of orders loaded per query (cf. iterate). If not set, all
+        # orders are loaded using a single query.
+        self.page_size = self.settings['page_size'] if 'page_size' in self.settings else None
+
+    def getStatistics(self):
+        """
+        Get statistics on the latest export (shown when running with --verbose).
+        """
+        return dict()
+
+    def getWatermark(self):
+        """
+        Get the watermark for the latest export (None if incremental export is not supported).
+        """
+        return None
+
     def info(self):
         # Remove trailing "Exporter"
         name = re.sub(r'Exporter$', '', self.__class__.__name__)
@@ -48,7 +149,152 @@ class Exporter():
 
     @staticmethod
     def formatAmount(amount):
-        return locale.format('%.2f', amount)
+        return AmountFormatter().format(amount)
+
+    def loadEventMetaData(self, event_ids):
+        """
+        Load meta data for a number of events (cf. pretix.base.models.event.Event.meta_data)
+        using a fixed number of queries.
+
+        event_ids can be an iterable of ids or a queryset selecting event ids.
+        """
+        events = Event.objects.filter(pk__in=event_ids)
+        organizer_ids = dict(events.values_list('pk', 'organizer_id'))
+
+        defaults = defaultdict(dict)
+        properties = EventMetaProperty.objects.filter(organizer_id__in=set(organizer_ids.values()))
+        for organizer_id, name, default in properties.values_list('organizer_id', 'name', 'default'):
+            defaults[organizer_id][name] = default
+
+        for event_id, organizer_id in organizer_ids.items():
+            self.event_meta_data[event_id] = dict(defaults[organizer_id])
+
+        values = EventMetaValue.objects.filter(event_id__in=organizer_ids.keys())
+        for event_id, name, value in values.values_list('event_id', 'property__name', 'value'):
+            self.event_meta_data[event_id][name] = value
+
+    def prefetchEventMetaData(self, orders):
+        """
+        Load meta data for all events in a collection of orders.
+
+        Querysets are returned as is; meta data for their events is loaded
+        while iterating (cf. iterate), so orders are queried only once.
+        Other collections are materialized as a list.
+        """
+        if isinstance(orders, QuerySet):
+            return orders
+
+        orders = list(orders)
+        event_ids = {order.event_id for order in orders} - set(self.event_meta_data.keys())
+        if event_ids:
+            self.loadEventMetaData(event_ids)
+
+        return orders
+
+    def streamEventMetaData(self, orders):
+        """
+        Pass on orders, loading meta data for new events in batches of orders
+        (cf. event_meta_data_batch_size).
+        """
+        batch = []
+        for order in orders:
+            batch.append(order)
+            if len(batch) >= self.event_meta_data_batch_size:
+                yield from self.prefetchEventMetaData(batch)
+                batch = []
+        yield from self.prefetchEventMetaData(batch)
+
+    def iterate(self, orders, event_meta_data=True):
+        """
+        Iterate over orders without caching the results (for querysets).
+
+        If a page size is set, querysets are loaded in pages using keyset
+        pagination (cf. pretix_itkexport.pagination) to avoid long running
+        queries. Otherwise a single query is used (and rows are fetched
+        using a server-side cursor on PostgreSQL).
+
+        Meta data for the events of orders in querysets is loaded on the way
+        (unless event_meta_data is False).
+        """
+        if not isinstance(orders, QuerySet):
+            iterator = iter(orders)
+        else:
+            iterator = iterateKeyset(orders, self.page_size) if self.page_size else orders.iterator()
+            if event_meta_data:
+                iterator = self.streamEventMetaData(iterator)
+
+        return self.profile('loadOrders', iterator)
+
+    def profile(self, name, iterable):
+        """
+        Charge producing items from an iterable to a profiler phase (when profiling).
+        """
+        return iterable if self.profiler is None else self.profiler.iterate(name, iterable)
+
+    def getScopeFilter(self, prefix='', **kwargs):
+        """
+        Get a filter limiting orders (or models related to orders using a
+        prefix, e.g. "order__") to some organizers and events (by slug) or
+        event ids (cf. pretix_itkexport.sharding).
+        """
+        scope_filter = dict()
+        if 'organizer' in kwargs:
+            scope_filter[prefix + 'event__organizer__slug__in'] = self.getList(kwargs['organizer'])
+        if 'event' in kwargs:
+            scope_filter[prefix + 'event__slug__in'] = self.getList(kwargs['event'])
+        if 'event_ids' in kwargs:
+            scope_filter[prefix + 'event_id__in'] = kwargs['event_ids']
+
+        return scope_filter
+
+    @staticmethod
+    def getList(value):
+        return [value] if isinstance(value, str) else list(value)
+
+    def getPartialData(self, **kwargs):
+        """
+        Get data for a part (shard) of the orders as a picklable object that
+        can be merged with other parts (cf. mergePartialData).
+        """
+        return list(self.getData(**kwargs))
+
+    def mergePartialData(self, parts, **kwargs):
+        """
+        Merge parts (cf. getPartialData) into data.
+        """
+        return [row for part in parts for row in part]
+
+    def getQueries(self, **kwargs):
+        """
+        Get the querysets loading orders (by loader name) for an export with
+        the specified settings (cf. the --explain option of itk-export).
+        """
+        return OrderedDict()
+
+    def getFingerprintOrders(self, **kwargs):
+        """
+        Get orders whose changes (cf. Order.last_modified) change the export
+        (cf. pretix_itkexport.resultcache), i.e. orders paid or refunded in
+        the period.
+        """
+        payment_filter = Q()
+        refund_filter = dict()
+        if 'starttime' in kwargs:
+            payment_filter &= Q(payment_date__gte=kwargs['starttime'])
+            refund_filter['datetime__gte'] = kwargs['starttime']
+        if 'endtime' in kwargs:
+            payment_filter &= Q(payment_date__lt=kwargs['endtime'])
+            refund_filter['datetime__lt'] = kwargs['endtime']
+
+        refunds = OrderRefund.objects.filter(**refund_filter).values('order_id')
+
+        return Order.objects.filter(**self.getScopeFilter(**kwargs)).filter(payment_filter | Q(pk__in=refunds))
+
+    def getEventMetaData(self, event_id, name):
+        if event_id not in self.event_meta_data:
+            self.loadEventMetaData([event_id])
+        meta_data = self.event_meta_data.get(event_id, {})
+        return meta_data[name] if name in meta_data else None
 
     def getData(self, **kwargs):
         paid_orders = self.loadPaidOrders(**kwargs)
@@ -70,27 +316,32 @@ class Exporter():
 
 
 class EventExporter(Exporter):
+    """
+    Exports revenue by event.
+
+    Use --engine=columnar to sum order totals in columns (using NumPy if
+    installed) rather than loading full orders.
+    """
+
     def getData(self, **kwargs):
-        order_filter = {
-            'status': Order.STATUS_PAID
-        }
-        if 'starttime' in kwargs:
-            order_filter['datetime__gte'] = kwargs['starttime']
-        if 'endtime' in kwargs:
-            order_filter['datetime__lt'] = kwargs['endtime']
+        if 'engine' in kwargs and kwargs['engine'] == 'columnar':
+            return self.getColumnarData(**kwargs)
 
-        orders = Order.objects.filter(**order_filter).order_by('datetime')
+        orders = self.prefetchEventMetaData(self.loadOrders(**kwargs))
 
+        events = dict()
         grouped_orders = defaultdict(list)
-        for order in orders:
-            grouped_orders[order.event].append(order)
+        for order in self.iterate(orders):
+            events[order.event_id] = order.event
+            grouped_orders[order.event_id].append(order)
 
         data = []
 
-        for event, orders in grouped_orders.items():
+        for event_id, orders in grouped_orders.items():
+            event = events[event_id]
             revenue = sum([order.total for order in orders])
             expenses = 0.0
-            audience = event.meta_data['Audience'] if 'Audience' in event.meta_data else None
+            audience = self.getEventMetaData(event_id, 'Audience')
 
             data.append({
                 'organizer': event.organizer,
@@ -103,6 +354,105 @@ class EventExporter(Exporter):
 
         return data
 
+    def getQueries(self, **kwargs):
+        if 'engine' in kwargs and kwargs['engine'] == 'columnar':
+            return OrderedDict([('loadOrderTotals', self.loadOrderTotals(**kwargs))])
+        return OrderedDict([('loadOrders', self.loadOrders(**kwargs))])
+
+    def loadOrders(self, **kwargs):
+        return Order.objects.filter(**self.getOrderFilter(**kwargs)).select_related('event__organizer').order_by('datetime', 'pk')
+
+    def loadOrderTotals(self, **kwargs):
+        return Order.objects.filter(**self.getOrderFilter(**kwargs)).order_by().values_list('event_id', 'total')
+
+    def getOrderFilter(self, **kwargs):
+        order_filter = {
+            'status': Order.STATUS_PAID
+        }
+        order_filter.update(self.getScopeFilter(**kwargs))
+        if 'starttime' in kwargs:
+            order_filter['datetime__gte'] = kwargs['starttime']
+        if 'endtime' in kwargs:
+            order_filter['datetime__lt'] = kwargs['endtime']
+
+        return order_filter
+
+    def getFingerprintOrders(self, **kwargs):
+        # Orders changing status are modified, so any status will do.
+        order_filter = self.getOrderFilter(**kwargs)
+        del order_filter['status']
+
+        return Order.objects.filter(**order_filter)
+
+    def getColumnarData(self, **kwargs):
+        """
+        Get data by loading only (event id, total) for each order into array
+        columns and summing totals by event.
+
+        Events (with organizer and audience) are loaded using a single query.
+        """
+        orders = self.loadOrderTotals(**kwargs)
+
+        # Totals are stored in cents to make them fit in an integer column.
+        event_ids = array('q')
+        totals = array('q')
+        # Rows are small, so (unlike orders) they are always loaded using a single query.
+        for event_id, total in self.profile('loadOrders', orders.iterator()):
+            event_ids.append(event_id)
+            totals.append(int(total * 100))
+
+        revenues = self.sumByGroup(event_ids, totals)
+        if not revenues:
+            return []
+
+        audience = Coalesce(
+            Subquery(EventMetaValue.objects.filter(event=OuterRef('pk'), property__name='Audience').values('value')[:1]),
+            Subquery(EventMetaProperty.objects.filter(organizer=OuterRef('organizer'), name='Audience').values('default')[:1]),
+            output_field=TextField()
+        )
+        events = Event.objects.filter(pk__in=list(revenues.keys())).select_related('organizer') \
+            .annotate(audience=audience).order_by('pk')
+
+        data = []
+
+        for event in events:
+            data.append({
+                'organizer': event.organizer,
+                'name': event.name,
+                'datetime': event.date_from,
+                'revenue': Decimal(revenues[event.pk]).scaleb(-2),
+                'expenses': 0.0,
+                'audience': event.audience
+            })
+
+        return data
+
+    @staticmethod
+    def sumByGroup(keys, values):
+        """
+        Sum (integer) values by (integer) key.
+
+        Uses NumPy if it is installed.
+        """
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+
+        if numpy is None or not keys:
+            sums = defaultdict(int)
+            for key, value in zip(keys, values):
+                sums[key] += value
+            return sums
+
+        keys = numpy.frombuffer(keys, dtype=numpy.int64)
+        values = numpy.frombuffer(values, dtype=numpy.int64)
+        unique_keys, indices = numpy.unique(keys, return_inverse=True)
+        sums = numpy.zeros(len(unique_keys), dtype=numpy.int64)
+        numpy.add.at(sums, indices, values)
+
+        return dict(zip(unique_keys.tolist(), sums.tolist()))
+
 
 class PaidOrdersExporter(Exporter):
     """
@@ -143,37 +493,220 @@ class PaidOrdersExporter(Exporter):
     index_amount = headers.index('Beløb')
     index_text = headers.index('Tekst')
 
+    def __init__(self):
+        super().__init__()
+
+        self.payment_info = PaymentInfoCache(self.settings['payment_info_cache_size'] if 'payment_info_cache_size' in self.settings else 10000)
+
+        # Row renderer (created in formatData).
+        self.renderer = None
+
+        # The latest order paid and refunded in the export.
+        self.watermark = {
+            'payment_date': None,
+            'order_id': None,
+            'refund_date': None,
+            'refund_id': None
+        }
+
+    def getWatermark(self):
+        """
+        Get the watermark (latest order paid and refunded) for the latest export.
+        """
+        return self.watermark
+
+    def getStatistics(self):
+        return {
+            'payment info cache hits': self.payment_info.hits,
+            'payment info cache misses': self.payment_info.misses
+        }
+
+    # Order fields used when exporting orders.
+    order_fields = ['code', 'event', 'email', 'status', 'total', 'payment_date', 'payment_provider', 'payment_info']
+
+    def getData(self, **kwargs):
+        if self.order_cache is not None and 'watermark' not in kwargs and not self.getScopeFilter(**kwargs):
+            orders = self.order_cache.get(self)
+        else:
+            orders = self.prefetchEventMetaData(self.loadOrders(**kwargs))
+
+        # Paid orders are generated while reading orders, and refunded and cash
+        # orders are collected on the way. formatData handles paid orders
+        # first, so the other lists are complete when they are needed.
+        refunded_orders = []
+        cash_orders = []
+        paid_orders = self.splitOrders(orders, refunded_orders, cash_orders, **kwargs)
+
+        return self.formatData(self.profile('groupOrders', self.groupOrders(paid_orders, **kwargs)),
+                               self.profile('groupOrders', self.groupOrders(refunded_orders, **kwargs)),
+                               cash_orders, **kwargs)
+
+    def getPartialData(self, **kwargs):
+        """
+        Get grouped paid and refunded orders and cash orders for a part of the orders.
+        """
+        orders = self.prefetchEventMetaData(self.loadOrders(**kwargs))
+        refunded_orders = []
+        cash_orders = []
+        paid_orders = list(self.groupOrders(self.splitOrders(orders, refunded_orders, cash_orders, **kwargs), **kwargs))
+
+        return paid_orders, list(self.groupOrders(refunded_orders, **kwargs)), cash_orders
+
+    def mergePartialData(self, parts, **kwargs):
+        """
+        Merge groups with the same key from all parts and format the data.
+        """
+        paid_orders = self.mergeOrderGroups(group for part in parts for group in part[0])
+        refunded_orders = self.mergeOrderGroups(group for part in parts for group in part[1])
+        cash_orders = sorted((order for part in parts for order in part[2]), key=lambda order: (order.payment_date, order.pk))
+
+        return self.formatData(paid_orders, refunded_orders, cash_orders, **kwargs)
+
+    @staticmethod
+    def mergeOrderGroups(groups):
+        """
+        Merge (key, amount, order_ids) triples with the same key (keeping the order of first occurrence).
+        """
+        merged = OrderedDict()
+        for key, amount, order_ids in groups:
+            if key in merged:
+                merged[key][0] += amount
+                if order_ids is not None:
+                    merged[key][1].extend(order_ids)
+            else:
+                merged[key] = [amount, list(order_ids) if order_ids is not None else None]
+
+        return [(key, amount, order_ids) for key, (amount, order_ids) in merged.items()]
+
+    def getQueries(self, **kwargs):
+        queries = OrderedDict([('loadOrders', self.loadOrders(**kwargs))])
+        # Used when aggregating in the database (paid-orders-grouped only).
+        for name in ['loadPaidOrders', 'loadRefundedOrders', 'loadCashOrders']:
+            queries[name] = getattr(PaidOrdersExporter, name)(self, **kwargs)
+
+        return queries
+
+    def loadOrders(self, **kwargs):
+        """
+        Load paid, refunded and cash orders in a single query (cf. splitOrders).
+
+        Orders paid in the period are loaded along with orders refunded in the period
+        (annotated with refund_date and refund_id).
+
+        If a watermark (cf. pretix_itkexport.models.ExportWatermark) is given,
+        only orders paid or refunded after the watermark are loaded.
+        """
+        refund_filter = Q()
+        payment_filter = Q(payment_provider__in=['dibs', 'cash'])
+        if 'starttime' in kwargs:
+            refund_filter &= Q(datetime__gte=kwargs['starttime'])
+            payment_filter &= Q(payment_date__gte=kwargs['starttime'])
+        if 'endtime' in kwargs:
+            refund_filter &= Q(datetime__lt=kwargs['endtime'])
+            payment_filter &= Q(payment_date__lt=kwargs['endtime'])
+
+        watermark = kwargs['watermark'] if 'watermark' in kwargs else None
+        if watermark is not None:
+            # Refunds may be indexed after the fact (cf. the itk-export-index-refunds command), i.e. their pks do not
+            # grow with their datetime.
+            if watermark.refund_date is not None:
+                refund_filter &= Q(datetime__gt=watermark.refund_date) \
+                    | Q(datetime=watermark.refund_date, pk__gt=watermark.refund_id)
+            elif watermark.refund_id is not None:
+                # Watermark saved before refund dates were tracked.
+                refund_filter &= Q(pk__gt=watermark.refund_id)
+            if watermark.payment_date is not None:
+                payment_filter &= Q(payment_date__gt=watermark.payment_date) \
+                    | Q(payment_date=watermark.payment_date, pk__gt=watermark.order_id)
+
+        refunds = OrderRefund.objects.filter(refund_filter)
+        # Refunds are looked up only for refunded (DIBS) orders, i.e. not for every order in the result.
+        order_refunds = refunds.filter(order=OuterRef('pk')).order_by('datetime', 'pk')
+        refunded = dict(status=Order.STATUS_REFUNDED, payment_provider='dibs')
+
+        orders = Order.objects.filter(
+            status__in=[Order.STATUS_PAID, Order.STATUS_REFUNDED],
+            total__gt=0,
+            **self.getScopeFilter(**kwargs)
+        ).filter(
+            payment_filter | Q(pk__in=refunds.values('order_id'), **refunded)
+        ).annotate(
+            refund_date=Case(When(then=Subquery(order_refunds.values('datetime')[:1]), **refunded), output_field=DateTimeField()),
+            refund_id=Case(When(then=Subquery(order_refunds.values('pk')[:1]), **refunded), output_field=IntegerField())
+        ).only(*self.order_fields).order_by('payment_date', 'pk')
+
+        return orders
+
+    def splitOrders(self, orders, refunded_orders, cash_orders, **kwargs):
+        """
+        Generate paid (DIBS) orders and collect refunded and cash orders.
+
+        The orders may have been loaded for a larger period (cf. OrderCache).
+        Keeps track of the latest order paid and refunded (cf. getWatermark).
+        """
+        starttime = kwargs['starttime'] if 'starttime' in kwargs else None
+        endtime = kwargs['endtime'] if 'endtime' in kwargs else None
+        watermark = kwargs['watermark'] if 'watermark' in kwargs else None
+        if watermark is not None and watermark.payment_date is None:
+            watermark = None
+
+        for order in self.iterate(orders):
+            if order.refund_date is not None and order.status == Order.STATUS_REFUNDED and order.payment_provider == 'dibs' \
+                    and (starttime is None or starttime <= order.refund_date) \
+                    and (endtime is None or order.refund_date < endtime):
+                refunded_orders.append(order)
+                if self.watermark['refund_date'] is None \
+                        or (self.watermark['refund_date'], self.watermark['refund_id']) < (order.refund_date, order.refund_id):
+                    self.watermark['refund_date'] = order.refund_date
+                    self.watermark['refund_id'] = order.refund_id
+            if order.payment_date is not None \
+                    and (starttime is None or starttime <= order.payment_date) \
+                    and (endtime is None or order.payment_date < endtime) \
+                    and (watermark is None or (watermark.payment_date, watermark.order_id) < (order.payment_date, order.pk)):
+                # Orders are sorted by (payment_date, pk).
+                self.watermark['payment_date'] = order.payment_date
+                self.watermark['order_id'] = order.pk
+                if order.payment_provider == 'cash':
+                    cash_orders.append(order)
+                elif order.payment_provider == 'dibs':
+                    yield order
+
     def loadPaidOrders(self, **kwargs):
         order_filter = {
             'status__in': [Order.STATUS_PAID, Order.STATUS_REFUNDED],
             'payment_provider': 'dibs',
             'total__gt': 0
         }
+        order_filter.update(self.getScopeFilter(**kwargs))
         if 'starttime' in kwargs:
             order_filter['payment_date__gte'] = kwargs['starttime']
         if 'endtime' in kwargs:
             order_filter['payment_date__lt'] = kwargs['endtime']
 
-        orders = Order.objects.filter(**order_filter).order_by('payment_date')
+        orders = Order.objects.filter(**order_filter).order_by('payment_date', 'pk')
 
         return orders
 
     def loadRefundedOrders(self, **kwargs):
-        # https://docs.djangoproject.com/en/2.0/topics/db/sql/#adding-annotations
-        order_table_name = Order.objects.model._meta.db_table
-        logentry_table_name = LogEntry.objects.model._meta.db_table
-        sql = 'select o.*, l.datetime refund_date from ' + order_table_name + ' o ' \
-            ' inner join ' + logentry_table_name + ' l on l.object_id = o.id and l.action_type = %(action_type)s' \
-            ' where o.status in %(status)s and o.payment_provider = %(payment_provider)s and o.total > 0' \
-            ' and %(starttime)s <= l.datetime and l.datetime < %(endtime)s'
-        parameters = {
-            'action_type': 'pretix.event.order.refunded',
-            'status': [Order.STATUS_REFUNDED],
+        # Refunds are found using the plugin's refund index (cf. pretix_itkexport.models.OrderRefund).
+        refund_filter = dict()
+        if 'starttime' in kwargs:
+            refund_filter['datetime__gte'] = kwargs['starttime']
+        if 'endtime' in kwargs:
+            refund_filter['datetime__lt'] = kwargs['endtime']
+        refunds = OrderRefund.objects.filter(**refund_filter)
+
+        order_filter = {
+            'status': Order.STATUS_REFUNDED,
             'payment_provider': 'dibs',
-            'starttime': kwargs['starttime'] if 'starttime' in kwargs else '2001-01-01',
-            'endtime': kwargs['endtime'] if 'endtime' in kwargs else '2087-01-01'
+            'total__gt': 0,
+            'pk__in': refunds.values('order_id')
         }
-        orders = Order.objects.raw(sql, parameters)
+        order_filter.update(self.getScopeFilter(**kwargs))
+
+        # Orders refunded more than once in the period count once (on the first refund) as in loadOrders.
+        refund_date = Subquery(refunds.filter(order=OuterRef('pk')).order_by('datetime').values('datetime')[:1], output_field=DateTimeField())
+        orders = Order.objects.filter(**order_filter).annotate(refund_date=refund_date).order_by('refund_date', 'pk')
 
         return orders
 
@@ -183,204 +716,338 @@ class PaidOrdersExporter(Exporter):
             'payment_provider': 'cash',
             'total__gt': 0
         }
+        order_filter.update(self.getScopeFilter(**kwargs))
         if 'starttime' in kwargs:
             order_filter['payment_date__gte'] = kwargs['starttime']
         if 'endtime' in kwargs:
             order_filter['payment_date__lt'] = kwargs['endtime']
 
-        orders = Order.objects.filter(**order_filter).order_by('payment_date')
+        orders = Order.objects.filter(**order_filter).order_by('payment_date', 'pk')
 
         return orders
 
     def formatData(self, paid_orders, refunded_orders, cash_orders, **kwargs):
-        raise Exception(self.__class__.__name__+'.formatData not implemented')
+        """
+        Generate rows from grouped paid and refunded orders and from cash orders.
 
-    def localizeCardType(self, card_type):
-        if DIBS.CARD_TYPE_CREDIT == card_type:
-            return _('credit')
-        if DIBS.CARD_TYPE_DEBIT == card_type:
-            return _('debit')
-        return card_type
+        paid_orders and refunded_orders must be iterables of (key, amount, order_ids)
+        triples, where key starts with (artskonto, pspelement, card_type). If
+        order_ids is None, the order ids are left out of the text.
 
-    def getCardType(self, order):
-        return DIBS.get_payment_card_type(order) if DIBS.identifier == order.payment_provider else None
+        Generates the headers followed by a LedgerLine for each row.
+        """
+        # Create the renderer when generating rows, i.e. with the language used for rendering activated.
+        self.renderer = RowRenderer(self.amount_formatter)
 
+        yield self.headers
 
-class PaidOrdersLineExporter(PaidOrdersExporter):
-    def loadPaidOrders(self, **kwargs):
-        orders = super().loadPaidOrders(**kwargs)
+        for key, amount, order_ids in paid_orders:
+            yield self.formatOrderGroup(key, amount, order_ids)
 
-        grouped_orders = defaultdict(list)
-        for order in orders:
-            meta_data = order.event.meta_data
-            pspelement = meta_data['PSP'] if 'PSP' in meta_data else None
-            card_type = self.getCardType(order)
-            order_id = DIBS.get_order_id(order)
+        for key, amount, order_ids in refunded_orders:
+            yield self.formatOrderGroup(key, amount, order_ids, refund=True)
 
-            grouped_orders[(self.debit_artskonto, None, card_type, order_id)].append(order)
-            grouped_orders[(self.credit_artskonto, pspelement, None, order_id)].append(order)
+        for order in self.iterate(self.prefetchEventMetaData(cash_orders)):
+            pspelement = self.getPSPElement(order)
 
-        return grouped_orders
+            line = LedgerLine(self.cash_artskonto, None, 'debet', order.total,
+                              self.renderer.formatCashText(self.getOrderId(order), order.email), self.renderer.amount_formatter)
 
-    def loadRefundedOrders(self, **kwargs):
-        orders = super().loadRefundedOrders(**kwargs)
+            yield line
 
-        grouped_orders = defaultdict(list)
-        for order in orders:
-            meta_data = order.event.meta_data
-            pspelement = meta_data['PSP'] if 'PSP' in meta_data else None
-            card_type = self.getCardType(order)
-            order_id = DIBS.get_order_id(order)
+            yield line.replace(artskonto=self.credit_artskonto, pspelement=pspelement, debit_credit='kredit')
 
-            grouped_orders[(self.debit_artskonto, None, card_type, order_id)].append(order)
-            grouped_orders[(self.credit_artskonto, pspelement, None, order_id)].append(order)
+    def groupOrders(self, orders, **kwargs):
+        """
+        Group orders into (key, amount, order_ids) triples (cf. formatData).
+        """
+        raise Exception(self.__class__.__name__+'.groupOrders not implemented')
 
-        return grouped_orders
+    def formatOrderGroup(self, key, amount, order_ids, refund=False):
+        artskonto, pspelement, card_type = key[:3]
+        debit_credit = self.getDebitCredit(pspelement, refund)
 
-    def formatData(self, paid_orders, refunded_orders, cash_orders, **kwargs):
-        rows = []
-        rows.append(self.headers)
-
-        for [artskonto, pspelement, card_type, order_id], orders in paid_orders.items():
-            amount = sum([order.total for order in orders])
-
-            row = [None] * len(self.headers)
-            row[self.index_artskonto] = artskonto
-            row[self.index_pspelement] = pspelement
-            row[self.index_debit_credit] = 'kredit' if pspelement is not None else 'debet'
-            row[self.index_amount] = self.formatAmount(amount)
-            order_ids = ', '.join([DIBS.get_order_id(order) for order in orders])
-            if card_type is not None:
-                row[self.index_text] = _('Ticket sale ({card_type}): {order_ids}').format(card_type=self.localizeCardType(card_type), order_ids=order_ids)
-            else:
-                row[self.index_text] = _('Ticket sale: {order_ids}').format(order_ids=order_ids)
-
-            rows.append(row)
+        return LedgerLine(artskonto, pspelement, debit_credit, amount, self.renderer.formatText(card_type, order_ids, refund=refund),
+                          self.renderer.amount_formatter)
 
-        for [artskonto, pspelement, card_type, order_id], orders in refunded_orders.items():
-            amount = sum([order.total for order in orders])
-
-            row = [None] * len(self.headers)
-            row[self.index_artskonto] = artskonto
-            row[self.index_pspelement] = pspelement
-            row[self.index_debit_credit] = 'debet' if pspelement is not None else 'kredit'
-            row[self.index_amount] = self.formatAmount(amount)
-            order_ids = ', '.join([DIBS.get_order_id(order) for order in orders])
-            if card_type is not None:
-                row[self.index_text] = _('Ticket refund ({card_type}): {order_ids}').format(card_type=self.localizeCardType(card_type), order_ids=order_ids)
-            else:
-                row[self.index_text] = _('Ticket refund: {order_ids}').format(order_ids=order_ids)
+    @staticmethod
+    def getDebitCredit(pspelement, refund=False):
+        if refund:
+            return 'debet' if pspelement is not None else 'kredit'
+        return 'kredit' if pspelement is not None else 'debet'
 
-            rows.append(row)
+    def getPSPElement(self, order):
+        return self.getEventMetaData(order.event_id, 'PSP')
 
-        for order in cash_orders:
-            meta_data = order.event.meta_data
-            pspelement = meta_data['PSP'] if 'PSP' in meta_data else None
+    def getOrderId(self, order):
+        return self.payment_info.get(order)[0]
 
-            row = [None] * len(self.headers)
-            row[self.index_artskonto] = self.cash_artskonto
-            row[self.index_debit_credit] = 'debet'
-            row[self.index_amount] = self.formatAmount(order.total)
-            row[self.index_text] = _('Cash payment ({user}): {order_id}').format(order_id=DIBS.get_order_id(order), user=order.email)
+    def getCardType(self, order):
+        return self.payment_info.get(order)[1]
 
-            rows.append(row)
 
-            row = list(row)
-            row[self.index_artskonto] = self.credit_artskonto
-            row[self.index_pspelement] = pspelement
-            row[self.index_debit_credit] = 'kredit'
+class LedgerLine():
+    """
+    A ledger line (row) in a paid orders export.
 
-            rows.append(row)
+    Only the fields actually used are stored. Iterating a line generates the
+    full row (cf. PaidOrdersExporter.headers) with the amount formatted.
+    """
 
-        return rows
+    __slots__ = ['artskonto', 'pspelement', 'debit_credit', 'amount', 'text', 'amount_formatter']
+
+    headers = PaidOrdersExporter.headers
+
+    def __init__(self, artskonto, pspelement, debit_credit, amount, text, amount_formatter):
+        self.artskonto = artskonto
+        self.pspelement = pspelement
+        self.debit_credit = debit_credit
+        self.amount = amount
+        self.text = text
+        self.amount_formatter = amount_formatter
+
+    def replace(self, **kwargs):
+        """
+        Get a copy of the line with some fields replaced.
+        """
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(kwargs)
+        return LedgerLine(**values)
+
+    def values(self):
+        """
+        Get the full row with the amount unformatted.
+        """
+        row = [None] * len(self.headers)
+        row[PaidOrdersExporter.index_artskonto] = self.artskonto
+        row[PaidOrdersExporter.index_pspelement] = self.pspelement
+        row[PaidOrdersExporter.index_debit_credit] = self.debit_credit
+        row[PaidOrdersExporter.index_amount] = self.amount
+        row[PaidOrdersExporter.index_text] = self.text
+        return row
+
+    def __iter__(self):
+        row = self.values()
+        row[PaidOrdersExporter.index_amount] = self.amount_formatter.format(self.amount)
+        return iter(row)
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __repr__(self):
+        return 'LedgerLine({!r}, {!r}, {!r}, {!r}, {!r})'.format(self.artskonto, self.pspelement, self.debit_credit, self.amount, self.text)
 
 
-class PaidOrdersGroupedExporter(PaidOrdersExporter):
-    """
-    Exports paid orders grouped by (artskonto, pspelement).
-    """
-
+class PaidOrdersLineExporter(PaidOrdersExporter):
     def loadPaidOrders(self, **kwargs):
         orders = super().loadPaidOrders(**kwargs)
-
-        grouped_orders = defaultdict(list)
-        for order in orders:
-            meta_data = order.event.meta_data
-            pspelement = meta_data['PSP'] if 'PSP' in meta_data else None
-            card_type = self.getCardType(order)
-
-            grouped_orders[(self.debit_artskonto, None, card_type)].append(order)
-            grouped_orders[(self.credit_artskonto, pspelement, None)].append(order)
-
-        return grouped_orders
+        return self.profile('groupOrders', self.groupOrders(self.prefetchEventMetaData(orders)))
 
     def loadRefundedOrders(self, **kwargs):
         orders = super().loadRefundedOrders(**kwargs)
+        return self.profile('groupOrders', self.groupOrders(self.prefetchEventMetaData(orders)))
 
-        grouped_orders = defaultdict(list)
-        for order in orders:
-            meta_data = order.event.meta_data
-            pspelement = meta_data['PSP'] if 'PSP' in meta_data else None
+    def groupOrders(self, orders, **kwargs):
+        # Each order makes up its own (debit and credit) groups, so we can
+        # generate the groups while reading the orders.
+        for order in self.iterate(orders):
+            pspelement = self.getPSPElement(order)
             card_type = self.getCardType(order)
+            order_id = self.getOrderId(order)
 
-            grouped_orders[(self.debit_artskonto, None, card_type)].append(order)
-            grouped_orders[(self.credit_artskonto, pspelement, None)].append(order)
+            yield (self.debit_artskonto, None, card_type, order_id), order.total, [order_id]
+            yield (self.credit_artskonto, pspelement, None, order_id), order.total, [order_id]
 
-        return grouped_orders
 
-    def formatData(self, paid_orders, refunded_orders, cash_orders, **kwargs):
-        rows = []
-        rows.append(self.headers)
-
-        for [artskonto, pspelement, card_type], orders in paid_orders.items():
-            amount = sum([order.total for order in orders])
-
-            row = [None] * len(self.headers)
-            row[self.index_artskonto] = artskonto
-            row[self.index_pspelement] = pspelement
-            row[self.index_debit_credit] = 'kredit' if pspelement is not None else 'debet'
-            row[self.index_amount] = self.formatAmount(amount)
-            order_ids = ', '.join([DIBS.get_order_id(order) for order in orders])
-            if card_type is not None:
-                row[self.index_text] = _('Ticket sale ({card_type}): {order_ids}').format(card_type=self.localizeCardType(card_type), order_ids=order_ids)
-            else:
-                row[self.index_text] = _('Ticket sale: {order_ids}').format(order_ids=order_ids)
+class PaidOrdersGroupedExporter(PaidOrdersExporter):
+    """
+    Exports paid orders grouped by (artskonto, pspelement).
+
+    Use `--aggregation=database` to sum credit amounts in the database,
+    `--compact-text` to leave out order ids and `--snapshots` to assemble
+    exports of whole (closed) days from daily ledger snapshots.
+    """
+
+    # Maximum number of days built from a single query (cf. buildSnapshots).
+    snapshot_span = 31
 
-            rows.append(row)
+    def getData(self, **kwargs):
+        if kwargs.get('aggregation') == 'database':
+            # Separate querysets for paid and refunded orders (cf. aggregateOrders).
+            return Exporter.getData(self, **kwargs)
+        if kwargs.get('snapshots'):
+            days = self.getSnapshotDays(**kwargs)
+            if days is not None:
+                return self.getSnapshotData(days, **kwargs)
+        return super().getData(**kwargs)
+
+    def getSnapshotDays(self, **kwargs):
+        """
+        Get the days in the export period if it can be assembled from snapshots,
+        i.e. if it consists of whole closed (UTC) days, and None otherwise.
+        """
+        if 'starttime' not in kwargs or 'endtime' not in kwargs or 'watermark' in kwargs or self.getScopeFilter(**kwargs):
+            return None
+
+        start = LedgerDay.getDay(kwargs['starttime'])
+        end = LedgerDay.getDay(kwargs['endtime'])
+        if LedgerDay.getStart(start) != kwargs['starttime'] or LedgerDay.getStart(end) != kwargs['endtime'] \
+                or end > LedgerDay.getDay(now()):
+            return None
+
+        return [start + timedelta(days=index) for index in range((end - start).days)]
+
+    def getSnapshotFingerprint(self):
+        return '{};{}'.format(self.debit_artskonto, self.credit_artskonto)
+
+    def getSnapshotData(self, days, **kwargs):
+        """
+        Get data by merging daily snapshots (building missing ones first).
+
+        Cash orders are not part of the snapshots and are loaded as usual.
+        Note that order ids in refund texts are listed by refund day.
+        """
+        compact_text = kwargs.get('compact_text', False)
+        self.buildSnapshots(days)
+
+        groups = {False: [], True: []}
+        rows = LedgerGroup.objects.filter(ledger_day__day__in=days).order_by('ledger_day__day', 'pk') \
+            .values_list('refund', 'artskonto', 'pspelement', 'card_type', 'amount', 'order_ids')
+        for refund, artskonto, pspelement, card_type, amount, order_ids in self.profile('loadOrders', rows.iterator()):
+            groups[refund].append(((artskonto, pspelement, card_type), amount, None if compact_text else order_ids.split('\n')))
+
+        paid_orders = self.mergeOrderGroups(groups[False])
+        refunded_orders = self.mergeOrderGroups(groups[True])
+        cash_orders = self.loadCashOrders(**kwargs).only(*self.order_fields)
 
-        for [artskonto, pspelement, card_type], orders in refunded_orders.items():
-            amount = sum([order.total for order in orders])
+        return self.formatData(paid_orders, refunded_orders, cash_orders, **kwargs)
 
-            row = [None] * len(self.headers)
-            row[self.index_artskonto] = artskonto
-            row[self.index_pspelement] = pspelement
-            row[self.index_debit_credit] = 'debet' if pspelement is not None else 'kredit'
-            row[self.index_amount] = self.formatAmount(amount)
-            order_ids = ', '.join([DIBS.get_order_id(order) for order in orders])
-            if card_type is not None:
-                row[self.index_text] = _('Ticket refund ({card_type}): {order_ids}').format(card_type=self.localizeCardType(card_type), order_ids=order_ids)
+    def buildSnapshots(self, days, rebuild=False):
+        """
+        Build snapshots for days (missing or built with other settings unless rebuilding).
+
+        Returns the days built.
+        """
+        fingerprint = self.getSnapshotFingerprint()
+        built = set()
+        if not rebuild:
+            built = set(LedgerDay.objects.filter(day__in=days, fingerprint=fingerprint).values_list('day', flat=True))
+        missing = sorted(set(days) - built)
+
+        # Build spans of consecutive days to load orders for each span using a single query.
+        spans = []
+        for day in missing:
+            if spans and spans[-1][-1] + timedelta(days=1) == day and len(spans[-1]) < self.snapshot_span:
+                spans[-1].append(day)
             else:
-                row[self.index_text] = _('Ticket refund: {order_ids}').format(order_ids=order_ids)
+                spans.append([day])
 
-            rows.append(row)
+        for span in spans:
+            self.buildSnapshotSpan(span, fingerprint)
 
-        for order in cash_orders:
-            meta_data = order.event.meta_data
-            pspelement = meta_data['PSP'] if 'PSP' in meta_data else None
+        return missing
 
-            row = [None] * len(self.headers)
-            row[self.index_artskonto] = self.cash_artskonto
-            row[self.index_debit_credit] = 'debet'
-            row[self.index_amount] = self.formatAmount(order.total)
-            row[self.index_text] = _('Cash payment ({user}): {order_id}').format(order_id=DIBS.get_order_id(order), user=order.email)
+    def buildSnapshotSpan(self, days, fingerprint):
+        """
+        Build snapshots for consecutive days.
+        """
+        period = {
+            'starttime': LedgerDay.getStart(days[0]),
+            'endtime': LedgerDay.getStart(days[-1] + timedelta(days=1))
+        }
+        orders = self.prefetchEventMetaData(self.loadOrders(**period))
+
+        # Paid and refunded orders by day.
+        paid_orders = OrderedDict((day, []) for day in days)
+        refunded_orders = OrderedDict((day, []) for day in days)
+        refunded = []
+        for order in self.splitOrders(orders, refunded, [], **period):
+            paid_orders[LedgerDay.getDay(order.payment_date)].append(order)
+        for order in refunded:
+            refunded_orders[LedgerDay.getDay(order.refund_date)].append(order)
+
+        with transaction.atomic():
+            LedgerDay.objects.filter(day__in=days).delete()
+            for day in days:
+                ledger_day = LedgerDay.objects.create(day=day, fingerprint=fingerprint)
+                groups = []
+                for refund, day_orders in [(False, paid_orders[day]), (True, refunded_orders[day])]:
+                    for (artskonto, pspelement, card_type), amount, order_ids in self.groupOrders(day_orders):
+                        groups.append(LedgerGroup(ledger_day=ledger_day, refund=refund, artskonto=artskonto, pspelement=pspelement,
+                                                  card_type=card_type, debit_credit=self.getDebitCredit(pspelement, refund),
+                                                  amount=amount, order_ids='\n'.join(order_ids)))
+                LedgerGroup.objects.bulk_create(groups)
+
+    def loadPaidOrders(self, **kwargs):
+        orders = super().loadPaidOrders(**kwargs)
+        return self.profile('groupOrders', self.groupOrders(self.prefetchEventMetaData(orders), **kwargs))
 
-            rows.append(row)
+    def loadRefundedOrders(self, **kwargs):
+        orders = super().loadRefundedOrders(**kwargs)
+        return self.profile('groupOrders', self.groupOrders(self.prefetchEventMetaData(orders), **kwargs))
+
+    def groupOrders(self, orders, **kwargs):
+        compact_text = kwargs.get('compact_text', False)
+        if kwargs.get('aggregation') == 'database' and isinstance(orders, QuerySet):
+            yield from self.aggregateOrders(orders, compact_text)
+            return
+
+        amounts = defaultdict(Decimal)
+        order_ids = defaultdict(list)
+        for order in self.iterate(orders):
+            pspelement = self.getPSPElement(order)
+            card_type = self.getCardType(order)
+            order_id = self.getOrderId(order)
 
-            row = list(row)
-            row[self.index_artskonto] = self.credit_artskonto
-            row[self.index_pspelement] = pspelement
-            row[self.index_debit_credit] = 'kredit'
+            for key in [(self.debit_artskonto, None, card_type), (self.credit_artskonto, pspelement, None)]:
+                amounts[key] += order.total
+                if not compact_text:
+                    order_ids[key].append(order_id)
 
-            rows.append(row)
+        for key, amount in amounts.items():
+            yield key, amount, None if compact_text else order_ids[key]
 
-        return rows
+    @staticmethod
+    def getPSPElementExpression():
+        """
+        Get an expression for the PSP element (event meta data) of an order.
+        """
+        return Coalesce(
+            Subquery(EventMetaValue.objects.filter(event=OuterRef('event'), property__name='PSP').values('value')[:1]),
+            Subquery(EventMetaProperty.objects.filter(organizer=OuterRef('event__organizer'), name='PSP').values('default')[:1]),
+            output_field=TextField()
+        )
+
+    def aggregateOrders(self, orders, compact_text=False):
+        """
+        Group orders and sum amounts in the database.
+
+        Credit amounts are summed by PSP element in the database. The card
+        type is part of the (JSON encoded) DIBS payment info and cannot be
+        computed in the database, so debit amounts are summed while reading
+        only the payment info and total of each order (and the order id and
+        PSP element for the texts unless compact_text is set).
+        """
+        credit_amounts = orders.order_by().annotate(pspelement=self.getPSPElementExpression()) \
+            .values('pspelement').annotate(amount=Sum('total')).order_by('pspelement')
+
+        if compact_text:
+            debit_orders = orders.only('payment_provider', 'payment_info', 'total')
+        else:
+            debit_orders = orders.only('code', 'payment_provider', 'payment_info', 'total').annotate(pspelement=self.getPSPElementExpression())
+
+        amounts = OrderedDict()
+        order_ids = defaultdict(list)
+        for order in self.iterate(debit_orders, event_meta_data=False):
+            key = (self.debit_artskonto, None, self.payment_info.getCardType(order))
+            amounts[key] = amounts.get(key, Decimal(0)) + order.total
+            if not compact_text:
+                order_id = self.getOrderId(order)
+                order_ids[key].append(order_id)
+                order_ids[(self.credit_artskonto, order.pspelement, None)].append(order_id)
+
+        for row in self.profile('loadOrders', credit_amounts.iterator()):
+            amounts[(self.credit_artskonto, row['pspelement'], None)] = row['amount']
+
+        for key, amount in amounts.items():
+            yield key, amount, None if compact_text else order_ids[key]
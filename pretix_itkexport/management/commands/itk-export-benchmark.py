@@ -0,0 +1,78 @@
+import json
+import locale
+import platform
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from pretix_itkexport.benchmark import Benchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks exporters on synthetic orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=str, default='1k', help='Number of orders, e.g. 1k, 100k or 1M')
+        parser.add_argument('--exporter', action='append', type=str,
+                            help='Exporter to run (can be used multiple times): ' + ', '.join(name for name, _, _ in Benchmark.cases))
+        parser.add_argument('--rendering', action='store_true', help='Also benchmark rendering rows (using --scale rows)')
+        parser.add_argument('--startup', action='store_true',
+                            help='Also benchmark importing the itk-export command (rows is the number of modules loaded)')
+        parser.add_argument('--repeat', type=int, default=1, help='Number of runs (the fastest is reported)')
+        parser.add_argument('--skip-fixtures', action='store_true', help='Use fixtures from a previous run')
+        parser.add_argument('--keep-fixtures', action='store_true', help='Do not delete fixtures after running')
+        parser.add_argument('--output', type=str, help='Write results as JSON to this file')
+        parser.add_argument('--compare', type=str, help='Compare with results from this (JSON) file')
+
+    def handle(self, *args, **options):
+        # Format amounts as the itk-export command does.
+        locale.setlocale(locale.LC_ALL, '')
+
+        benchmark = Benchmark()
+
+        try:
+            number_of_orders = Benchmark.parseScale(options['scale'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        if not options['skip_fixtures']:
+            self.stderr.write('Creating {} orders …'.format(number_of_orders))
+            benchmark.createFixtures(number_of_orders)
+
+        try:
+            results = dict()
+            for run in range(options['repeat']):
+                run_results = benchmark.run(options['exporter'])
+                if options['rendering']:
+                    run_results.update(benchmark.runRendering(number_of_orders))
+                if options['startup']:
+                    run_results.update(benchmark.runStartup())
+                for name, result in run_results.items():
+                    if name not in results or result['seconds'] < results[name]['seconds']:
+                        results[name] = result
+        finally:
+            if not options['keep_fixtures']:
+                benchmark.deleteFixtures()
+
+        report = {
+            'created': datetime.now().isoformat(),
+            'orders': number_of_orders,
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'results': results
+        }
+
+        previous = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)['results']
+
+        for name, result in results.items():
+            line = '{:<45} {:>10.3f} s {:>8} queries {:>10} rows'.format(name, result['seconds'], result['queries'], result['rows'])
+            if previous is not None and name in previous and previous[name]['seconds'] > 0:
+                line += ' ({:+.1%})'.format(result['seconds'] / previous[name]['seconds'] - 1)
+            self.stdout.write(line)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
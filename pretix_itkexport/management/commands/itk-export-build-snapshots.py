@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+from pretix_itkexport.exporters import PaidOrdersGroupedExporter
+from pretix_itkexport.models import LedgerDay
+from pretix_itkexport.periods import resolvePeriod
+
+
+class Command(BaseCommand):
+    help = 'Builds daily ledger snapshots used by paid orders grouped exports (cf. itk-export --snapshots)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=31, help='Number of (closed) days before today to build')
+        parser.add_argument('--period', nargs='?', type=str, help='Build the closed days in a period (e.g. previous-year) instead')
+        parser.add_argument('--rebuild', action='store_true', help='Rebuild days already built')
+
+    def handle(self, *args, **options):
+        today = LedgerDay.getDay(now())
+        if options['period']:
+            try:
+                starttime, endtime = resolvePeriod(options['period'])
+            except ValueError as e:
+                raise CommandError(e)
+            start = LedgerDay.getDay(starttime)
+            end = min(LedgerDay.getDay(endtime), today)
+            days = [start + timedelta(days=index) for index in range((end - start).days)]
+        else:
+            days = [today - timedelta(days=index) for index in range(options['days'], 0, -1)]
+
+        built = PaidOrdersGroupedExporter().buildSnapshots(days, rebuild=options['rebuild'])
+
+        self.stdout.write('Built snapshots for {} of {} day(s)'.format(len(built), len(days)))
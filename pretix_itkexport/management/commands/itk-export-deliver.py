@@ -0,0 +1,19 @@
+import django.conf
+from django.core.management.base import BaseCommand
+from pretix_itkexport.outbox import Outbox
+
+
+class Command(BaseCommand):
+    help = 'Sends export e-mails waiting in the outbox (cf. itk-export --outbox)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', nargs='?', type=int, help='Number of messages claimed and sent at a time')
+
+    def handle(self, *args, **options):
+        settings = django.conf.settings.ITK_EXPORT.copy() if hasattr(django.conf.settings, 'ITK_EXPORT') else {}
+        if options['batch_size'] is not None:
+            settings['outbox_batch_size'] = options['batch_size']
+
+        sent, failed = Outbox.fromSettings(settings).deliver()
+
+        self.stdout.write('Sent {} message(s), {} failed'.format(sent, failed))
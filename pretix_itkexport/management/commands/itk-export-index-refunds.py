@@ -0,0 +1,38 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from pretix.base.models.log import LogEntry
+from pretix.base.models.orders import Order
+from pretix_itkexport.models import OrderRefund
+
+
+class Command(BaseCommand):
+    help = 'Indexes order refunds not yet indexed (e.g. refunds made before installing the plugin)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--all', action='store_true', help='Rebuild the index from scratch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        if options['all']:
+            OrderRefund.objects.all().delete()
+
+        logentries = LogEntry.objects.filter(
+            action_type=OrderRefund.action_type,
+            content_type=ContentType.objects.get_for_model(Order),
+            object_id__in=Order.objects.values('pk')
+        ).exclude(
+            pk__in=OrderRefund.objects.values('logentry_id')
+        ).order_by('pk').values_list('pk', 'object_id', 'datetime')
+
+        count = 0
+        last_logentry_id = 0
+        while True:
+            batch = list(logentries.filter(pk__gt=last_logentry_id)[:batch_size])
+            if not batch:
+                break
+            count += OrderRefund.index(batch)
+            last_logentry_id = batch[-1][0]
+
+        self.stdout.write('Indexed {} refund(s)'.format(count))
@@ -1,19 +1,25 @@
+import contextlib
 import csv
-import io
-import re
-from datetime import date, datetime, timedelta
+import json
+import locale
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
 
-import dateparser
 import django.conf
-import pytz
-import yaml
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 from django.utils import translation
+from django.utils.module_loading import import_string
 from django.utils.translation import ugettext_lazy as _
-from pretix_itkexport.exporters import (
-    EventExporter, PaidOrdersLineExporter, PaidOrdersGroupedExporter,
-)
+from pretix_itkexport.models import ExportWatermark
+from pretix_itkexport.periods import parseDatetime, period_names, resolvePeriod
+
+# Modules used only by some exports (exporters, writers, yaml, …) are
+# imported when needed to keep the command fast to start.
 
 
 class Command(BaseCommand):
@@ -21,26 +27,72 @@ class Command(BaseCommand):
 
     date_format = '%Y-%m-%d'
 
+    # Maximum size of CSV content kept in memory before spooling to disk.
+    spool_max_size = 8 * 1024 * 1024
+
+    # Cf. pretix_itkexport.writers.ArrowWriter.formats
+    formats = ['csv', 'parquet', 'arrow']
+
+    # Cf. pretix_itkexport.attachments.AttachmentWriter.compressions
+    compressions = ['gzip', 'zip']
+
+    # Options that cannot be used in batch (on the command line or in jobs).
+    batch_unsupported_options = ['info', 'incremental', 'shards', 'append', 'explain', 'profile', 'profile_dump']
+
+    # Exporter classes by export type (imported when selected).
     exporter_classes = {
-        'event': EventExporter,
-        'paid-orders': PaidOrdersLineExporter,
-        'paid-orders-grouped': PaidOrdersGroupedExporter
+        'event': 'pretix_itkexport.exporters.EventExporter',
+        'paid-orders': 'pretix_itkexport.exporters.PaidOrdersLineExporter',
+        'paid-orders-grouped': 'pretix_itkexport.exporters.PaidOrdersGroupedExporter'
     }
 
     def add_arguments(self, parser):
-        parser.add_argument('export_type', type=str, help=', '.join(Command.exporter_classes.keys()))
+        parser.add_argument('export_type', type=str, help=', '.join(Command.exporter_classes.keys()) + ' or batch (run jobs)')
         parser.add_argument('--info', action='store_true', help='Show info on the specified export type')
         parser.add_argument('--starttime', nargs='?', type=str)
         parser.add_argument('--endtime', nargs='?', type=str)
         parser.add_argument('--period', nargs='?', type=str,
-                            help='current-year, previous-year, '
-                                 'current-month, previous-month, '
-                                 'current-week, previous-week, '
-                                 'current-day, today, '
-                                 'previous-day, yesterday'
-                                 ', previous-week[±days]'
-                            )
+                            help=', '.join(period_names) + ', previous-week[±days]')
+        parser.add_argument('--organizer', action='append', type=str, help='Export only orders for this organizer (slug, can be used multiple times)')
+        parser.add_argument('--event', action='append', type=str, help='Export only orders for this event (slug, can be used multiple times)')
+        parser.add_argument('--shards', nargs='?', type=int,
+                            help='Split the export by event across this many worker processes')
+        parser.add_argument('--page-size', nargs='?', type=int,
+                            help='Load orders in pages of this size (using keyset pagination) rather than in a single query')
+        parser.add_argument('--aggregation', nargs='?', type=str, choices=['python', 'database'],
+                            help='Group orders and sum amounts in Python or sum credit amounts in the database (paid-orders-grouped only)')
+        parser.add_argument('--snapshots', action='store_const', const=True,
+                            help='Assemble exports of whole closed days from daily ledger snapshots (paid-orders-grouped only)')
+        parser.add_argument('--result-cache', action='store_const', const=True,
+                            help='Reuse the result of an earlier export of a period that has ended if no orders in the period have changed')
+        parser.add_argument('--engine', nargs='?', type=str, choices=['python', 'columnar'],
+                            help='How to sum order totals by event (event only)')
+        parser.add_argument('--compact-text', action='store_true', help='Leave out order ids in text (paid-orders-grouped only)')
+        parser.add_argument('--format', nargs='?', type=str, choices=Command.formats,
+                            help='Output format (default: csv); parquet and arrow require pyarrow')
+        parser.add_argument('--compress', nargs='?', type=str, choices=Command.compressions,
+                            help='Compress e-mail attachments')
+        parser.add_argument('--attachment-max-size', nargs='?', type=int,
+                            help='Split e-mail attachments into numbered parts of (approximately) at most this many bytes')
         parser.add_argument('--recipient', action='append', nargs='?', type=str, help='Email adress to send export result to (can be used multiple times)')
+        parser.add_argument('--outbox', action='store_const', const=True,
+                            help='Store e-mails in the outbox (sent by itk-export-deliver or pretix\' periodic tasks) rather than sending them')
+        parser.add_argument('--balance-check', nargs='?', type=str, choices=['warn', 'fail', 'off'],
+                            help='What to do if debit and credit totals differ (default: warn); fail does not send e-mails')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Export only orders paid or refunded since the previous incremental export of the same type '
+                                 '(the first incremental export uses the specified period)')
+        parser.add_argument('--append', nargs='?', type=str, help='Append export result to this (ledger) file')
+        parser.add_argument('--jobs', nargs='?', type=str,
+                            help='YAML file with jobs (export_type, period, recipient, …) to run in batch (default: "jobs" setting)')
+        parser.add_argument('--workers', nargs='?', type=int, default=4, help='Number of jobs to run in parallel in batch')
+        parser.add_argument('--profile', nargs='?', type=str, const='table', choices=['table', 'json'],
+                            help='Show time, database queries and peak memory for each export phase (on stderr)')
+        parser.add_argument('--profile-dump', nargs='?', type=str, help='Dump cProfile stats for generating rows to this file')
+        parser.add_argument('--explain', action='store_true',
+                            help='Show query plans for the queries loading orders (rather than exporting) and fail on sequential scans of large tables')
+        parser.add_argument('--seq-scan-threshold', nargs='?', type=int,
+                            help='Number of rows in a table over which sequential scans fail --explain (default: 10000)')
         parser.add_argument('--debug', action='store_true')
         parser.add_argument('--verbose', action='store_true')
 
@@ -52,9 +104,13 @@ class Command(BaseCommand):
             debug = options['debug']
             verbose = debug or options['verbose']
 
+            # Make Python locale aware (and use LC_ALL from environment)
+            locale.setlocale(locale.LC_ALL, '')
+
             settings = self.getSettings(options)
 
             if debug:
+                import yaml
                 print('options:')
                 print(yaml.dump(options, default_flow_style=False))
 
@@ -62,67 +118,466 @@ class Command(BaseCommand):
                 print(yaml.dump(settings, default_flow_style=False))
 
             export_type = settings['export_type']
+            if export_type == 'batch':
+                self.handleBatch(options, verbose)
+                return
+
             if export_type not in Command.exporter_classes:
                 raise CommandError('Unknown export type: {}'.format(export_type))
 
-            exporter = Command.exporter_classes[export_type]()
+            exporter = self.getExporter(export_type, settings)
 
             if options['info']:
                 print(exporter.info())
                 return
 
-            data = exporter.getData(**settings)
+            watermark = None
+            if options['incremental']:
+                if exporter.getWatermark() is None:
+                    raise CommandError('Export type {} does not support incremental export'.format(export_type))
+                if 'aggregation' in settings and settings['aggregation'] == 'database':
+                    raise CommandError('Incremental export does not support database aggregation')
+                if 'shards' in settings and settings['shards'] > 1:
+                    raise CommandError('Incremental export does not support sharding')
+                watermark, created = ExportWatermark.objects.get_or_create(export_type=export_type)
+                if watermark.payment_date is not None or watermark.refund_id is not None:
+                    settings.pop('starttime', None)
+                settings['watermark'] = watermark
+
+            if options['explain']:
+                self.explain(exporter, settings)
+                return
+
+            profiler = None
+            if options['profile']:
+                from pretix_itkexport.profiling import Profiler
+                profiler = Profiler()
+                profiler.start()
+                exporter.profiler = profiler
+
+            def load():
+                if 'shards' in settings and settings['shards'] > 1:
+                    from pretix_itkexport.sharding import ShardedExport
+                    return ShardedExport(Command.exporter_classes[export_type], settings['shards']).getData(exporter, **settings)
+                return exporter.getData(**settings)
+
+            result_cache = self.getResultCache(settings)
+            with self.phase(profiler, 'getData'):
+                data = load() if result_cache is None else result_cache.getData(exporter, load, **settings)
+            if profiler is not None:
+                data = profiler.iterate('formatData', data)
+
+            cprofile = None
+            if options['profile_dump']:
+                import cProfile
+                cprofile = cProfile.Profile()
+                data = self.cprofile(cprofile, data)
 
             recipient_list = settings['recipient_list']
+            output_format = settings['format']
+
+            summary = None
+            if not recipient_list:
+                from pretix_itkexport.summary import ExportSummary
+                summary = ExportSummary()
+                data = summary.collect(data)
 
             if recipient_list:
-                now = datetime.now()
-                filename = 'eventbillet-{}.csv'.format(now.strftime('%Y%m%dT%H%M'))
-                if 'starttime' in settings:
-                    filename = 'eventbillet-{:%Y%m%d}'.format(settings['starttime'])
-                    if 'endtime' in settings:
-                        filename += '-{:%Y%m%d}'.format(settings['endtime'])
-                    filename += '.csv'
-
-                output = io.StringIO()
-                writer = csv.writer(output, dialect='excel', delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-                for row in data:
-                    writer.writerow(row)
-                content = output.getvalue()
-                output.close()
-
-                subject = _('Order export from {site_name}').format(site_name=django.conf.settings.PRETIX_INSTANCE_NAME)
-                if 'starttime' in settings:
-                    starttime = settings['starttime']
-                    endtime = settings['endtime'] if 'endtime' in settings else now
-                    subject += ' ({:%Y-%m-%d}–{:%Y-%m-%d})'.format(starttime, endtime)
-                body = content
-                from_email = settings['from_email']
-
-                email = EmailMessage(
-                    subject=subject,
-                    body=body,
-                    from_email=from_email,
-                    to=recipient_list,
-                    attachments=[
-                        (filename, content, 'text/csv'),
-                    ]
-                )
-
-                email.send(fail_silently=False)
+                attachments, summary = self.renderAttachments(data, settings, profiler)
+                # Check before sending.
+                self.checkBalance(summary, settings)
+                messages = self.createMessages(settings, attachments, summary)
+
+                if settings.get('outbox'):
+                    from pretix_itkexport.outbox import Outbox
+                    with self.phase(profiler, 'store'):
+                        Outbox.fromSettings(settings).add(messages)
+                else:
+                    with self.phase(profiler, 'send'):
+                        get_connection(fail_silently=False).send_messages(messages)
 
                 if verbose:
-                    print(content)
-                    print('Sent to: {}'.format(', '.join(recipient_list)))
-                    print('Subject: {}'.format(subject))
+                    print(messages[0].body)
+                    print('{}: {}'.format('Stored for' if settings.get('outbox') else 'Sent to', ', '.join(recipient_list)))
+                    for message in messages:
+                        print('Subject: {}'.format(message.subject))
+
+            elif 'append' in settings:
+                if 'csv' != output_format:
+                    raise CommandError('Cannot append to {} files'.format(output_format))
+                path = settings['append']
+                # Write the header row only when creating the file.
+                is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+                with tempfile.SpooledTemporaryFile(max_size=self.spool_max_size, mode='w+', encoding='utf-8', newline='') as rows:
+                    with self.phase(profiler, 'render'):
+                        writer = csv.writer(rows, dialect='excel', delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                        for index, row in enumerate(data):
+                            if index > 0 or is_new:
+                                writer.writerow(row)
+                    # Append only exports passing the balance check.
+                    self.checkBalance(summary, settings)
+                    rows.seek(0)
+                    with open(path, 'a', encoding='utf-8', newline='') as output:
+                        shutil.copyfileobj(rows, output)
+
+            elif 'csv' != output_format:
+                from pretix_itkexport.writers import ArrowWriter
+                with self.phase(profiler, 'render'):
+                    self.stdout.flush()
+                    ArrowWriter(sys.stdout.buffer, output_format).write(data)
+                    sys.stdout.buffer.flush()
 
             else:
-                writer = csv.writer(self.stdout)
-                for row in data:
-                    writer.writerow(row)
+                with self.phase(profiler, 'render'):
+                    writer = csv.writer(self.stdout)
+                    for row in data:
+                        writer.writerow(row)
+
+            if not recipient_list:
+                if verbose:
+                    self.stderr.write(summary.format())
+                if 'append' not in settings:
+                    self.checkBalance(summary, settings)
+
+            if watermark is not None:
+                watermark.update(exporter.getWatermark())
+
+            if cprofile is not None:
+                cprofile.dump_stats(options['profile_dump'])
+
+            if profiler is not None:
+                profiler.stop()
+                if options['profile'] == 'json':
+                    self.stderr.write(json.dumps(profiler.getSummary(), indent=2))
+                else:
+                    self.stderr.write(profiler.formatSummary())
+
+            if verbose:
+                for name, value in exporter.getStatistics().items():
+                    self.stderr.write('{}: {}'.format(name, value))
+                if result_cache is not None:
+                    self.stderr.write('result cache hits: {}'.format(result_cache.hits))
+                    self.stderr.write('result cache misses: {}'.format(result_cache.misses))
         except Exception as e:
             raise e if debug else CommandError(e)
 
+    def handleBatch(self, options, verbose=False):
+        """
+        Run a batch of jobs in parallel and send all e-mails using a single connection.
+
+        Paid orders exporters with overlapping periods share orders loaded once
+        for a period covering their jobs (cf. getOrderCaches).
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from pretix_itkexport.summary import ExportSummary
+
+        self.checkBatchOptions(options)
+        jobs = self.getJobs(options)
+
+        order_caches = self.getOrderCaches(jobs)
+        result_caches = [self.getResultCache(job) for job in jobs]
+
+        def run(job, order_cache, result_cache):
+            translation.activate(django.conf.settings.LANGUAGE_CODE)
+            try:
+                exporter = self.getExporter(job['export_type'], job)
+                if order_cache is not None:
+                    exporter.order_cache = order_cache
+                if result_cache is None:
+                    data = exporter.getData(**job)
+                else:
+                    data = result_cache.getData(exporter, lambda: exporter.getData(**job), **job)
+                if job['recipient_list']:
+                    attachments, summary = self.renderAttachments(data, job)
+                    self.checkBalance(summary, job)
+                    return self.createMessages(job, attachments, summary)
+                summary = ExportSummary()
+                content = self.renderContent(summary.collect(data), output_format=job['format'])
+                self.checkBalance(summary, job)
+                return content
+            finally:
+                # Close the database connection(s) opened by this thread.
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            futures = [executor.submit(run, job, order_cache, result_cache)
+                       for job, order_cache, result_cache in zip(jobs, order_caches, result_caches)]
+
+        messages = []
+        outbox_messages = []
+        errors = []
+        for index, (job, future) in enumerate(zip(jobs, futures)):
+            try:
+                result = future.result()
+            except Exception as e:
+                errors.append(e)
+                self.stderr.write('Job {} ({}) failed: {}'.format(index + 1, job['export_type'], e))
+                continue
+
+            if job['recipient_list']:
+                (outbox_messages if job.get('outbox') else messages).extend(result)
+            elif isinstance(result, bytes):
+                self.stdout.flush()
+                sys.stdout.buffer.write(result)
+                sys.stdout.buffer.flush()
+            else:
+                self.stdout.write(result)
+
+        if outbox_messages:
+            from pretix_itkexport.outbox import Outbox
+            Outbox.fromSettings(jobs[0]).add(outbox_messages)
+
+            if verbose:
+                for message in outbox_messages:
+                    print('Stored for: {}'.format(', '.join(message.to)))
+                    print('Subject: {}'.format(message.subject))
+
+        if messages:
+            connection = get_connection(fail_silently=False)
+            connection.send_messages(messages)
+
+            if verbose:
+                for message in messages:
+                    print('Sent to: {}'.format(', '.join(message.to)))
+                    print('Subject: {}'.format(message.subject))
+
+        if errors:
+            raise CommandError('{} of {} job(s) failed'.format(len(errors), len(jobs)))
+
+    def checkBatchOptions(self, options, job=None):
+        """
+        Reject options (on the command line or in a job) that batch does not support.
+        """
+        for name in Command.batch_unsupported_options:
+            if options.get(name):
+                raise CommandError('Batch does not support --{}{}'.format(name.replace('_', '-'), ' (in job)' if job else ''))
+
+    def getOrderCaches(self, jobs):
+        """
+        Get an order cache (cf. pretix_itkexport.exporters.OrderCache) for
+        each job (None for jobs not exporting paid orders).
+
+        Jobs with overlapping periods share a cache covering their periods.
+        A job without a start (or end) time overlaps all jobs starting
+        before (or ending after) it.
+        """
+        from pretix_itkexport.exporters import OrderCache, PaidOrdersExporter
+
+        indexes = [index for index, job in enumerate(jobs)
+                   if issubclass(import_string(Command.exporter_classes[job['export_type']]), PaidOrdersExporter)]
+        # Sort by start time (jobs without a start time first).
+        indexes.sort(key=lambda index: ('starttime' in jobs[index], jobs[index].get('starttime')))
+
+        # Groups of (period, job indexes).
+        groups = []
+        for index in indexes:
+            job = jobs[index]
+            if groups:
+                period, group = groups[-1]
+                if 'endtime' not in period or 'starttime' not in job or job['starttime'] < period['endtime']:
+                    if 'endtime' not in job:
+                        period.pop('endtime', None)
+                    elif 'endtime' in period:
+                        period['endtime'] = max(period['endtime'], job['endtime'])
+                    group.append(index)
+                    continue
+            groups.append(({name: job[name] for name in ['starttime', 'endtime'] if name in job}, [index]))
+
+        order_caches = [None] * len(jobs)
+        for period, group in groups:
+            order_cache = OrderCache(**period)
+            for index in group:
+                order_caches[index] = order_cache
+
+        return order_caches
+
+    def getExporter(self, export_type, settings):
+        """
+        Create an exporter (importing its class).
+        """
+        exporter = import_string(Command.exporter_classes[export_type])()
+        if 'page_size' in settings:
+            exporter.page_size = settings['page_size']
+
+        return exporter
+
+    def checkBalance(self, summary, settings):
+        """
+        Check that debit and credit totals of an export are equal (cf. the balance_check setting).
+        """
+        balance_check = settings['balance_check'] if 'balance_check' in settings else 'warn'
+        if 'off' == balance_check or summary.isBalanced():
+            return
+        if 'fail' == balance_check:
+            raise CommandError(summary.formatImbalance())
+        self.stderr.write(summary.formatImbalance())
+
+    def explain(self, exporter, settings):
+        """
+        Show query plans for the queries loading orders and check for sequential scans of large tables.
+        """
+        from pretix_itkexport.explain import QueryExplainer
+
+        explainer = QueryExplainer(settings['seq_scan_threshold'] if 'seq_scan_threshold' in settings else 10000)
+        scans = []
+        for name, queryset in exporter.getQueries(**settings).items():
+            lines, query_scans = explainer.explain(queryset)
+            self.stdout.write('-- {}'.format(name))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write('')
+            for line in lines:
+                self.stdout.write(line)
+            self.stdout.write('')
+            for table, size in query_scans:
+                self.stderr.write('{}: Sequential scan on {} ({} rows)'.format(name, table, size))
+            scans.extend(query_scans)
+
+        if scans:
+            raise CommandError('{} sequential scan(s) of tables with more than {} rows'.format(len(scans), explainer.threshold))
+
+    def getResultCache(self, settings):
+        """
+        Get a result cache (cf. pretix_itkexport.resultcache) if enabled.
+        """
+        if not settings.get('result_cache'):
+            return None
+
+        from pretix_itkexport.resultcache import ResultCache
+        result_cache = ResultCache()
+        if 'result_cache_timeout' in settings:
+            result_cache.timeout = timedelta(seconds=settings['result_cache_timeout'])
+        if 'result_cache_max_rows' in settings:
+            result_cache.max_rows = settings['result_cache_max_rows']
+        if 'result_cache_max_bytes' in settings:
+            result_cache.max_bytes = settings['result_cache_max_bytes']
+        return result_cache
+
+    def getJobs(self, options):
+        import yaml
+
+        if options['jobs']:
+            with open(options['jobs']) as f:
+                jobs = yaml.safe_load(f)
+        else:
+            settings = django.conf.settings.ITK_EXPORT if hasattr(django.conf.settings, 'ITK_EXPORT') else {}
+            jobs = settings['jobs'] if 'jobs' in settings else None
+            if isinstance(jobs, str):
+                jobs = yaml.safe_load(jobs)
+
+        if not jobs:
+            raise CommandError('No jobs to run')
+
+        job_settings = []
+        for job in jobs:
+            self.checkBatchOptions(job, job)
+            job_options = dict(options)
+            job_options.update(job)
+            if isinstance(job_options['recipient'], str):
+                job_options['recipient'] = [job_options['recipient']]
+            settings = self.getSettings(job_options)
+            if settings['export_type'] not in Command.exporter_classes:
+                raise CommandError('Unknown export type in job: {}'.format(settings['export_type']))
+            job_settings.append(settings)
+
+        return job_settings
+
+    def renderContent(self, data, profiler=None, output_format='csv'):
+        """
+        Render rows as CSV (str) or in a binary format (bytes).
+        """
+        if 'csv' != output_format:
+            from pretix_itkexport.writers import ArrowWriter
+            with tempfile.SpooledTemporaryFile(max_size=self.spool_max_size, mode='w+b') as output, self.phase(profiler, 'render'):
+                ArrowWriter(output, output_format).write(data)
+                output.seek(0)
+                return output.read()
+
+        with tempfile.SpooledTemporaryFile(max_size=self.spool_max_size, mode='w+', encoding='utf-8', newline='') as output, \
+                self.phase(profiler, 'render'):
+            writer = csv.writer(output, dialect='excel', delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            for row in data:
+                writer.writerow(row)
+            output.seek(0)
+            return output.read()
+
+    def renderAttachments(self, data, settings, profiler=None):
+        """
+        Render rows as (compressed) attachments for e-mails, split into parts
+        if the attachment_max_size setting is set.
+
+        Returns the attachments and a summary of the export.
+        """
+        from pretix_itkexport.attachments import AttachmentWriter
+        from pretix_itkexport.summary import ExportSummary
+
+        summary = ExportSummary()
+        writer = AttachmentWriter(self.getBasename(settings), output_format=settings['format'],
+                                  compression=settings['compress'] if 'compress' in settings else None,
+                                  max_size=settings['attachment_max_size'] if 'attachment_max_size' in settings else None,
+                                  spool_max_size=self.spool_max_size)
+        with self.phase(profiler, 'render'):
+            attachments = writer.write(summary.collect(data))
+
+        return attachments, summary
+
+    def getBasename(self, settings):
+        """
+        Get the base name (without extension) for export files.
+        """
+        basename = 'eventbillet-{}'.format(datetime.now().strftime('%Y%m%dT%H%M'))
+        if 'starttime' in settings:
+            basename = 'eventbillet-{:%Y%m%d}'.format(settings['starttime'])
+            if 'endtime' in settings:
+                basename += '-{:%Y%m%d}'.format(settings['endtime'])
+        return basename
+
+    def createMessages(self, settings, attachments, summary):
+        """
+        Create an e-mail for each attachment (part) with a summary of the export in the body.
+        """
+        subject = _('Order export from {site_name}').format(site_name=django.conf.settings.PRETIX_INSTANCE_NAME)
+        if 'starttime' in settings:
+            starttime = settings['starttime']
+            endtime = settings['endtime'] if 'endtime' in settings else datetime.now()
+            subject += ' ({:%Y-%m-%d}–{:%Y-%m-%d})'.format(starttime, endtime)
+        body = summary.format()
+        from_email = settings['from_email']
+
+        messages = []
+        for number, attachment in enumerate(attachments, 1):
+            message_subject = subject
+            if len(attachments) > 1:
+                message_subject += ' ' + _('(part {number} of {count})').format(number=number, count=len(attachments))
+            messages.append(EmailMessage(
+                subject=message_subject,
+                body=body,
+                from_email=from_email,
+                to=settings['recipient_list'],
+                attachments=[attachment]
+            ))
+
+        return messages
+
+    @staticmethod
+    def phase(profiler, name):
+        return profiler.phase(name) if profiler is not None else contextlib.suppress()
+
+    @staticmethod
+    def cprofile(cprofile, data):
+        """
+        Run cProfile while generating rows.
+        """
+        iterator = iter(data)
+        while True:
+            cprofile.enable()
+            try:
+                row = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                cprofile.disable()
+            yield row
+
     def getSettings(self, options):
         settings = django.conf.settings.ITK_EXPORT.copy() if hasattr(django.conf.settings, 'ITK_EXPORT') else {}
 
@@ -131,25 +586,19 @@ class Command(BaseCommand):
                 settings[name] = options[name]
 
         if 'period' in settings:
-            (starttime, endtime) = self.getPeriod(settings['period'])
-
-            settings['starttime'] = starttime.isoformat()
-            settings['endtime'] = endtime.isoformat()
-
-        if 'starttime' in settings:
-            d = dateparser.parse(settings['starttime'])
-            if d is None:
-                raise CommandError('Error parsing starttime: {}'.format(settings['starttime']))
-            if d.tzinfo is None or d.tzinfo.utcoffset(d) is None:
-                d = pytz.utc.localize(d)
-            settings['starttime'] = d
-        if 'endtime' in settings:
-            d = dateparser.parse(settings['endtime'])
-            if d is None:
-                raise CommandError('Error parsing endtime: {}'.format(settings['endtime']))
-            if d.tzinfo is None or d.tzinfo.utcoffset(d) is None:
-                d = pytz.utc.localize(d)
-            settings['endtime'] = d
+            (settings['starttime'], settings['endtime']) = self.getPeriod(settings['period'])
+        else:
+            for name in ['starttime', 'endtime']:
+                if name in settings:
+                    d = parseDatetime(settings[name])
+                    if d is None:
+                        raise CommandError('Error parsing {}: {}'.format(name, settings[name]))
+                    settings[name] = d
+
+        if 'format' not in settings:
+            settings['format'] = 'csv'
+        if settings['format'] not in Command.formats:
+            raise CommandError('Invalid format: {}'.format(settings['format']))
 
         settings['recipient_list'] = settings['recipient'] if 'recipient' in settings else None
         settings['from_email'] = settings['sender'] if 'sender' in settings else None
@@ -157,60 +606,7 @@ class Command(BaseCommand):
         return settings
 
     def getPeriod(self, period):
-        starttime = None
-        endtime = None
-
-        today = dateparser.parse(date.today().strftime('%Y-%m-%d'))
-        # Monday in the current week
-        this_monday = today - timedelta(days=today.weekday())
-
-        if period == 'current-year':
-            starttime = dateparser.parse(datetime.today().strftime('%Y-01-01'))
-            endtime = dateparser.parse('in 1 year', settings={'RELATIVE_BASE': starttime, 'PREFER_DATES_FROM': 'future'})
-
-        elif period == 'previous-year':
-            start_of_year = dateparser.parse(datetime.today().strftime('%Y-01-01'))
-            starttime = dateparser.parse('1 year ago', settings={'RELATIVE_BASE': start_of_year})
-            endtime = dateparser.parse('in 1 year', settings={'RELATIVE_BASE': starttime, 'PREFER_DATES_FROM': 'future'})
-
-        elif period == 'current-month':
-            starttime = dateparser.parse(datetime.today().strftime('%Y-%m-01'))
-            endtime = dateparser.parse('in 1 month', settings={'RELATIVE_BASE': starttime, 'PREFER_DATES_FROM': 'future'})
-
-        elif period == 'previous-month':
-            start_of_month = dateparser.parse(datetime.today().strftime('%Y-%m-01'))
-            starttime = dateparser.parse('1 month ago', settings={'RELATIVE_BASE': start_of_month})
-            endtime = dateparser.parse('in 1 month', settings={'RELATIVE_BASE': starttime, 'PREFER_DATES_FROM': 'future'})
-
-        elif period == 'current-week':
-            starttime = this_monday
-            endtime = dateparser.parse('in 1 week', settings={'RELATIVE_BASE': starttime, 'PREFER_DATES_FROM': 'future'})
-
-        elif re.match(r'previous-week([+-]\d+)?', period):
-            match = re.match(r'previous-week([+-]\d+)?', period)
-            offset = int(match.group(1)) if match.group(1) is not None else 0
-
-            start_of_week = this_monday
-            starttime = dateparser.parse('Monday', settings={'RELATIVE_BASE': start_of_week})
-            endtime = dateparser.parse('in 1 week', settings={'RELATIVE_BASE': starttime, 'PREFER_DATES_FROM': 'future'})
-
-            if offset != 0:
-                starttime += timedelta(days=offset)
-                endtime += timedelta(days=offset)
-
-        elif period == 'current-day' or period == 'today':
-            starttime = dateparser.parse('00:00:00')
-            endtime = dateparser.parse('in 1 day', settings={'RELATIVE_BASE': starttime, 'PREFER_DATES_FROM': 'future'})
-
-        elif period == 'previous-day' or period == 'yesterday':
-            starttime = dateparser.parse('yesterday 00:00:00')
-            endtime = dateparser.parse('in 1 day', settings={'RELATIVE_BASE': starttime, 'PREFER_DATES_FROM': 'future'})
-
-        else:
-            raise CommandError('Invalid period: {}'.format(period))
-
-        # https://docs.djangoproject.com/en/1.11/topics/i18n/timezones/
-        starttime = pytz.utc.localize(starttime)
-        endtime = pytz.utc.localize(endtime)
-
-        return (starttime, endtime)
+        try:
+            return resolvePeriod(period)
+        except ValueError as e:
+            raise CommandError(e)
@@ -0,0 +1,26 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('pretixbase', '0095_auto_20180604_1129'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderRefund',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime', models.DateTimeField(db_index=True)),
+                ('logentry', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pretixbase.LogEntry')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='itk_refunds', to='pretixbase.Order')),
+            ],
+            options={
+                'ordering': ('datetime',),
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_itkexport', '0002_exportwatermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('fingerprint', models.CharField(max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerGroup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('refund', models.BooleanField(default=False)),
+                ('artskonto', models.CharField(max_length=255)),
+                ('pspelement', models.TextField(null=True)),
+                ('card_type', models.CharField(max_length=255, null=True)),
+                ('debit_credit', models.CharField(max_length=16)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('order_ids', models.TextField()),
+                ('ledger_day', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='groups', to='pretix_itkexport.LedgerDay')),
+            ],
+        ),
+    ]
@@ -0,0 +1,64 @@
+import django.conf
+from django.db import migrations
+
+# Indexes matching the predicates of the exporter queries (cf. the --explain
+# option of itk-export): name, (app label, model), columns and condition (for
+# partial indexes).
+indexes = [
+    # PaidOrdersExporter.loadOrders and PaidOrdersExporter.loadCashOrders
+    ('pretix_itkexport_order_payment', ('pretixbase', 'Order'), ['payment_date', 'id'],
+     "status IN ('p', 'r') AND total > 0 AND payment_provider IN ('dibs', 'cash')"),
+    # EventExporter
+    ('pretix_itkexport_order_paid', ('pretixbase', 'Order'), ['datetime', 'id'], "status = 'p'"),
+    # Refunds in a period for an order (cf. PaidOrdersExporter.loadOrders)
+    ('pretix_itkexport_refund_order', ('pretix_itkexport', 'OrderRefund'), ['order_id', 'datetime'], None),
+    # Refund log entries (cf. the itk-export-index-refunds command)
+    ('pretix_itkexport_logentry_refund', ('pretixbase', 'LogEntry'), ['id'], "action_type = 'pretix.event.order.refunded'"),
+]
+
+# Backends supporting partial indexes.
+vendors = ['postgresql', 'sqlite']
+
+
+def isEnabled(schema_editor):
+    settings = django.conf.settings.ITK_EXPORT if hasattr(django.conf.settings, 'ITK_EXPORT') else {}
+    return schema_editor.connection.vendor in vendors and settings.get('create_indexes', True)
+
+
+def createIndexes(apps, schema_editor):
+    if not isEnabled(schema_editor):
+        return
+
+    quote_name = schema_editor.quote_name
+    # Do not lock orders for writing while building indexes.
+    concurrently = 'CONCURRENTLY ' if schema_editor.connection.vendor == 'postgresql' else ''
+    for name, model, columns, condition in indexes:
+        table = apps.get_model(*model)._meta.db_table
+        sql = 'CREATE INDEX {}IF NOT EXISTS {} ON {} ({})'.format(concurrently, quote_name(name), quote_name(table),
+                                                                  ', '.join(quote_name(column) for column in columns))
+        if condition is not None:
+            sql += ' WHERE ' + condition
+        schema_editor.execute(sql)
+
+
+def dropIndexes(apps, schema_editor):
+    if not isEnabled(schema_editor):
+        return
+
+    for name, model, columns, condition in indexes:
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(schema_editor.quote_name(name)))
+
+
+class Migration(migrations.Migration):
+
+    # Indexes cannot be created concurrently in a transaction.
+    atomic = False
+
+    dependencies = [
+        ('pretixbase', '0095_auto_20180604_1129'),
+        ('pretix_itkexport', '0004_exportfile'),
+    ]
+
+    operations = [
+        migrations.RunPython(createIndexes, dropIndexes),
+    ]
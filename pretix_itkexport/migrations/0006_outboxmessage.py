@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_itkexport', '0005_exporter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.TextField()),
+                ('body', models.TextField()),
+                ('from_email', models.CharField(max_length=255, null=True)),
+                ('recipients', models.TextField()),
+                ('filename', models.CharField(max_length=255, null=True)),
+                ('content', models.BinaryField(null=True)),
+                ('content_type', models.CharField(max_length=255, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(db_index=True, null=True)),
+                ('sent', models.DateTimeField(null=True)),
+                ('error', models.TextField(blank=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_itkexport', '0006_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportwatermark',
+            name='refund_date',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
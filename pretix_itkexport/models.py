@@ -0,0 +1,178 @@
+from datetime import datetime
+
+from django.db import models
+from django.utils.timezone import now, utc
+from pretix.base.models import CachedFile
+from pretix.base.models.log import LogEntry
+from pretix.base.models.orders import Order
+
+
+class OrderRefund(models.Model):
+    """
+    Index of order refunds (cf. the "pretix.event.order.refunded" log entries).
+
+    Lets us find orders refunded in a period without scanning the log.
+    """
+
+    action_type = 'pretix.event.order.refunded'
+
+    order = models.ForeignKey(Order, related_name='itk_refunds', on_delete=models.CASCADE)
+    logentry = models.OneToOneField(LogEntry, related_name='+', on_delete=models.CASCADE)
+    datetime = models.DateTimeField(db_index=True)
+
+    class Meta:
+        ordering = ('datetime',)
+
+    @classmethod
+    def index(cls, logentries, invalidate=True):
+        """
+        Index refund log entries (as (id, object_id, datetime) tuples).
+
+        Set invalidate to False only for refunds not changing any ledger
+        snapshots (e.g. benchmark fixtures).
+        """
+        refunds = [cls(logentry_id=id, order_id=object_id, datetime=datetime) for id, object_id, datetime in logentries]
+        cls.objects.bulk_create(refunds)
+        if invalidate:
+            # Refunds indexed after the fact (cf. the itk-export-index-refunds command) change closed days.
+            LedgerDay.invalidate(refund.datetime for refund in refunds)
+
+        return len(refunds)
+
+
+class ExportWatermark(models.Model):
+    """
+    The latest order paid and refunded in incremental exports of a type.
+    """
+
+    export_type = models.CharField(max_length=64, unique=True)
+    payment_date = models.DateTimeField(null=True)
+    order_id = models.PositiveIntegerField(null=True)
+    refund_date = models.DateTimeField(null=True)
+    refund_id = models.PositiveIntegerField(null=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def update(self, watermark):
+        """
+        Move the watermark forward (values that are None are not changed).
+        """
+        for name in ['payment_date', 'order_id', 'refund_date', 'refund_id']:
+            if watermark[name] is not None:
+                setattr(self, name, watermark[name])
+        self.save()
+
+
+class LedgerDay(models.Model):
+    """
+    A (UTC) day with materialized ledger groups (cf. LedgerGroup).
+
+    The fingerprint identifies the settings used when building the groups.
+    Deleting a day invalidates its groups.
+    """
+
+    day = models.DateField(unique=True)
+    fingerprint = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def getDay(value):
+        """
+        Get the (UTC) day of a datetime.
+        """
+        return value.astimezone(utc).date()
+
+    @staticmethod
+    def getStart(day):
+        """
+        Get the start (UTC) of a day.
+        """
+        return datetime.combine(day, datetime.min.time()).replace(tzinfo=utc)
+
+    @classmethod
+    def invalidate(cls, datetimes):
+        """
+        Invalidate the closed days (i.e. days before today) containing some datetimes.
+        """
+        today = cls.getDay(now())
+        days = {cls.getDay(value) for value in datetimes if value is not None}
+        days = [day for day in days if day < today]
+        if days:
+            cls.objects.filter(day__in=days).delete()
+
+        return days
+
+
+class LedgerGroup(models.Model):
+    """
+    Orders paid (or refunded) on a day grouped by (artskonto, pspelement,
+    card_type) as in paid orders grouped exports.
+    """
+
+    ledger_day = models.ForeignKey(LedgerDay, related_name='groups', on_delete=models.CASCADE)
+    refund = models.BooleanField(default=False)
+    artskonto = models.CharField(max_length=255)
+    pspelement = models.TextField(null=True)
+    card_type = models.CharField(max_length=255, null=True)
+    debit_credit = models.CharField(max_length=16)
+    amount = models.DecimalField(max_digits=16, decimal_places=2)
+    # Order ids separated by newlines.
+    order_ids = models.TextField()
+
+
+class ExportFile(models.Model):
+    """
+    A file generated by a data exporter (cf. pretix_itkexport.dataexporters)
+    reused for identical exports (of closed periods).
+    """
+
+    key = models.CharField(max_length=255, unique=True)
+    cachedfile = models.ForeignKey(CachedFile, related_name='+', on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class OutboxMessage(models.Model):
+    """
+    An export e-mail waiting to be sent (cf. pretix_itkexport.outbox).
+
+    next_attempt is None when the message has been sent or given up on.
+    """
+
+    subject = models.TextField()
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, null=True)
+    # Recipients separated by newlines.
+    recipients = models.TextField()
+    filename = models.CharField(max_length=255, null=True)
+    content = models.BinaryField(null=True)
+    content_type = models.CharField(max_length=255, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(null=True, db_index=True)
+    sent = models.DateTimeField(null=True)
+    error = models.TextField(blank=True)
+
+    @classmethod
+    def fromMessage(cls, message):
+        """
+        Create an (unsaved) outbox message from an e-mail with at most one attachment.
+        """
+        outbox_message = cls(subject=message.subject, body=message.body, from_email=message.from_email,
+                             recipients='\n'.join(message.to), next_attempt=now())
+        if message.attachments:
+            filename, content, content_type = message.attachments[0]
+            # Text attachments are decoded by EmailMessage.
+            outbox_message.filename = filename
+            outbox_message.content = content.encode('utf-8') if isinstance(content, str) else content
+            outbox_message.content_type = content_type
+
+        return outbox_message
+
+    def getMessage(self):
+        """
+        Get the e-mail to send.
+        """
+        from django.core.mail import EmailMessage
+
+        attachments = [(self.filename, bytes(self.content), self.content_type)] if self.content is not None else []
+        return EmailMessage(subject=self.subject, body=self.body, from_email=self.from_email,
+                            to=self.recipients.split('\n'), attachments=attachments)
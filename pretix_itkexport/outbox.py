@@ -0,0 +1,138 @@
+from datetime import timedelta
+
+from django.core.mail import get_connection
+from django.db import connection as db_connection, transaction
+from django.utils.timezone import now
+
+from .models import OutboxMessage
+
+
+class Outbox():
+    """
+    Persistent outbox for export e-mails.
+
+    Exports store their (rendered) e-mails in the outbox (cf. add), and the
+    e-mails are delivered separately (cf. deliver) using a single connection
+    for all messages. Messages that cannot be sent are retried with
+    exponential backoff.
+
+    Messages are claimed (by moving their next attempt claim_timeout ahead)
+    before they are sent, so no rows are locked while talking to the mail
+    server, and messages claimed by a delivery that crashed are retried
+    when the claim expires.
+    """
+
+    def __init__(self, batch_size=50, max_attempts=10, retry_delay=timedelta(minutes=1), max_retry_delay=timedelta(days=1),
+                 claim_timeout=timedelta(hours=1)):
+        # Number of messages claimed and sent at a time.
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.claim_timeout = claim_timeout
+
+    @classmethod
+    def fromSettings(cls, settings):
+        """
+        Create an outbox using the outbox_batch_size and outbox_max_attempts settings (if set).
+        """
+        return cls(**{name: settings['outbox_' + name] for name in ['batch_size', 'max_attempts'] if 'outbox_' + name in settings})
+
+    def add(self, messages):
+        """
+        Store e-mails in the outbox (all or none).
+        """
+        outbox_messages = [OutboxMessage.fromMessage(message) for message in messages]
+        with transaction.atomic():
+            for outbox_message in outbox_messages:
+                outbox_message.save()
+
+        return outbox_messages
+
+    def getRetryDelay(self, attempts):
+        """
+        Get the delay before the next attempt after a number of failed attempts.
+        """
+        return min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+
+    def deliver(self, connection=None):
+        """
+        Send messages that are due.
+
+        If the connection cannot be opened, the messages due count as failed
+        attempts (and are retried later).
+
+        Returns the number of messages sent and failed.
+        """
+        sent = 0
+        failed = 0
+        connection = connection if connection is not None else get_connection(fail_silently=False)
+        # Messages failing in this run are not retried until the next run.
+        start = now()
+
+        opened = False
+        connection_error = None
+        try:
+            while True:
+                batch = self.claim(start)
+                if not batch:
+                    break
+
+                if not opened and connection_error is None:
+                    try:
+                        connection.open()
+                        opened = True
+                    except Exception as e:
+                        connection_error = e
+
+                for outbox_message in batch:
+                    if connection_error is not None:
+                        outbox_message.attempts += 1
+                        self.fail(outbox_message, connection_error)
+                        failed += 1
+                    elif self.send(connection, outbox_message):
+                        sent += 1
+                    else:
+                        failed += 1
+        finally:
+            if opened:
+                connection.close()
+
+        return sent, failed
+
+    def claim(self, start):
+        """
+        Claim a batch of messages due at start.
+        """
+        messages = OutboxMessage.objects.filter(next_attempt__lte=start).order_by('next_attempt', 'pk')
+        with transaction.atomic():
+            # Skip messages locked by another delivery (on backends supporting it).
+            batch = list(messages.select_for_update(skip_locked=db_connection.features.has_select_for_update_skip_locked)[:self.batch_size])
+            if batch:
+                OutboxMessage.objects.filter(pk__in=[outbox_message.pk for outbox_message in batch]) \
+                    .update(next_attempt=now() + self.claim_timeout)
+
+        return batch
+
+    def send(self, connection, outbox_message):
+        outbox_message.attempts += 1
+        try:
+            connection.send_messages([outbox_message.getMessage()])
+        except Exception as e:
+            self.fail(outbox_message, e)
+            return False
+
+        outbox_message.sent = now()
+        outbox_message.next_attempt = None
+        outbox_message.error = ''
+        outbox_message.save(update_fields=['attempts', 'error', 'next_attempt', 'sent'])
+        return True
+
+    def fail(self, outbox_message, error):
+        outbox_message.error = str(error)
+        if outbox_message.attempts < self.max_attempts:
+            outbox_message.next_attempt = now() + self.getRetryDelay(outbox_message.attempts)
+        else:
+            # Give up.
+            outbox_message.next_attempt = None
+        outbox_message.save(update_fields=['attempts', 'error', 'next_attempt'])
@@ -0,0 +1,41 @@
+from django.db.models import Q
+
+
+def iterateKeyset(queryset, page_size):
+    """
+    Iterate over a queryset ordered by (field, pk) or pk in pages using
+    keyset pagination, i.e. each page is loaded by a separate (short) query
+    selecting rows after the last row of the previous page.
+
+    Rows with a NULL field value come first (databases do not agree on where
+    to put them).
+    """
+    ordering = list(queryset.query.order_by)
+    if ordering[-1:] != ['pk'] or len(ordering) > 2 or ordering[0].startswith('-'):
+        raise ValueError('Keyset pagination requires ordering by (field, pk) or pk: {}'.format(ordering))
+    field = ordering[0] if len(ordering) == 2 else None
+
+    if field is not None:
+        yield from iteratePages(queryset.filter(**{field + '__isnull': True}).order_by('pk'), None, page_size)
+        queryset = queryset.filter(**{field + '__isnull': False})
+
+    yield from iteratePages(queryset, field, page_size)
+
+
+def iteratePages(queryset, field, page_size):
+    last = None
+    while True:
+        page = queryset
+        if last is not None:
+            if field is None:
+                page = page.filter(pk__gt=last.pk)
+            else:
+                value = getattr(last, field)
+                page = page.filter(Q(**{field + '__gt': value}) | Q(**{field: value, 'pk__gt': last.pk}))
+
+        rows = list(page[:page_size])
+        yield from rows
+
+        if len(rows) < page_size:
+            return
+        last = rows[-1]
@@ -0,0 +1,109 @@
+import re
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import utc
+
+period_names = [
+    'current-year', 'previous-year',
+    'current-month', 'previous-month',
+    'current-week', 'previous-week',
+    'current-day', 'today',
+    'previous-day', 'yesterday',
+]
+
+
+def addMonths(day, months):
+    """
+    Add a number of months to the first day of a month.
+    """
+    month = day.month - 1 + months
+    return day.replace(year=day.year + month // 12, month=month % 12 + 1)
+
+
+def resolvePeriod(period, today=None):
+    """
+    Resolve a period name, e.g. "previous-month" or "previous-week+3", into
+    a (starttime, endtime) pair of UTC datetimes (midnight) relative to today.
+
+    Raises ValueError if the period is invalid.
+    """
+    return _resolvePeriod(period, today if today is not None else date.today())
+
+
+@lru_cache(maxsize=64)
+def _resolvePeriod(period, today):
+    # Monday in the current week
+    this_monday = today - timedelta(days=today.weekday())
+
+    match = re.match(r'^previous-week([+-]\d+)?$', period)
+
+    if period == 'current-year':
+        start = today.replace(month=1, day=1)
+        end = start.replace(year=start.year + 1)
+
+    elif period == 'previous-year':
+        start = today.replace(year=today.year - 1, month=1, day=1)
+        end = start.replace(year=start.year + 1)
+
+    elif period == 'current-month':
+        start = today.replace(day=1)
+        end = addMonths(start, 1)
+
+    elif period == 'previous-month':
+        start = addMonths(today.replace(day=1), -1)
+        end = addMonths(start, 1)
+
+    elif period == 'current-week':
+        start = this_monday
+        end = start + timedelta(weeks=1)
+
+    elif match is not None:
+        offset = int(match.group(1)) if match.group(1) is not None else 0
+        start = this_monday - timedelta(weeks=1) + timedelta(days=offset)
+        end = start + timedelta(weeks=1)
+
+    elif period == 'current-day' or period == 'today':
+        start = today
+        end = start + timedelta(days=1)
+
+    elif period == 'previous-day' or period == 'yesterday':
+        start = today - timedelta(days=1)
+        end = start + timedelta(days=1)
+
+    else:
+        raise ValueError('Invalid period: {}'.format(period))
+
+    # https://docs.djangoproject.com/en/1.11/topics/i18n/timezones/
+    return (datetime.combine(start, datetime.min.time()).replace(tzinfo=utc),
+            datetime.combine(end, datetime.min.time()).replace(tzinfo=utc))
+
+
+def parseDatetime(value):
+    """
+    Parse a datetime (naive datetimes are taken to be UTC).
+
+    ISO 8601 dates and datetimes are parsed directly and dateparser (which
+    is slow to load) is only used for other (free-form) values, e.g.
+    "2 days ago".
+
+    Returns None if the value cannot be parsed.
+    """
+    if isinstance(value, datetime):
+        d = value
+    elif isinstance(value, date):
+        d = datetime.combine(value, datetime.min.time())
+    else:
+        d = parse_datetime(value)
+        if d is None:
+            day = parse_date(value)
+            d = datetime.combine(day, datetime.min.time()) if day is not None else None
+        if d is None:
+            import dateparser
+            d = dateparser.parse(value)
+
+    if d is not None and (d.tzinfo is None or d.tzinfo.utcoffset(d) is None):
+        d = d.replace(tzinfo=utc)
+
+    return d
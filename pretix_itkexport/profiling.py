@@ -0,0 +1,139 @@
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class Profiler():
+    """
+    Records wall time, database queries (count and time) and peak memory by phase.
+
+    Phases can be nested, and time and queries are charged to the innermost
+    active phase only, i.e. the numbers for a phase do not include nested
+    phases. Peak memory is the largest increase in (traced) memory use over
+    the memory in use when the phase was entered, including nested phases.
+
+    On Python versions without tracemalloc.reset_peak (before 3.9) the peak
+    cannot be reset, so memory use is sampled whenever phases are entered
+    or left (or items are produced, cf. iterate) instead.
+
+    Note that Django only keeps the latest 9000 queries, so query numbers are
+    only reliable if fewer queries are run between entering and leaving
+    phases.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.connection = connections[using]
+        self.queries = CaptureQueriesContext(self.connection)
+        self.phases = OrderedDict()
+        self.stack = []
+        self.started = None
+        # The latest query charged (cf. getQueries).
+        self.last_query = None
+        # Memory in use when entering each active phase.
+        self.entry_memory = []
+
+    def start(self):
+        tracemalloc.start()
+        self.queries.__enter__()
+        self.started = time.perf_counter()
+        self.last_query = self.connection.queries_log[-1] if self.connection.queries_log else None
+
+    def stop(self):
+        self.charge()
+        self.queries.__exit__(None, None, None)
+        tracemalloc.stop()
+
+    def charge(self):
+        """
+        Charge time and queries since the last charge to the current phase
+        and memory use to all active phases.
+        """
+        now = time.perf_counter()
+        queries = self.getQueries()
+        if self.stack:
+            phase = self.phases[self.stack[-1]]
+            phase['seconds'] += now - self.started
+            phase['queries'] += len(queries)
+            phase['query_seconds'] += sum(float(query['time']) for query in queries)
+        self.started = now
+
+        current, peak = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:
+            peak = current
+        for name, entry_memory in zip(self.stack, self.entry_memory):
+            phase = self.phases[name]
+            phase['peak_memory'] = max(phase['peak_memory'], peak - entry_memory)
+
+    def getQueries(self):
+        """
+        Get the queries logged since the last call.
+
+        The query log is a bounded deque, so new queries are found by
+        scanning back from the end to the latest query seen.
+        """
+        queries = []
+        for query in reversed(self.connection.queries_log):
+            if query is self.last_query:
+                break
+            queries.append(query)
+        if queries:
+            self.last_query = queries[0]
+        queries.reverse()
+
+        return queries
+
+    def enter(self, name):
+        self.charge()
+        if name not in self.phases:
+            self.phases[name] = {
+                'seconds': 0.0,
+                'queries': 0,
+                'query_seconds': 0.0,
+                'peak_memory': 0
+            }
+        self.stack.append(name)
+        self.entry_memory.append(tracemalloc.get_traced_memory()[0])
+
+    def leave(self):
+        self.charge()
+        self.stack.pop()
+        self.entry_memory.pop()
+
+    @contextmanager
+    def phase(self, name):
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.leave()
+
+    def iterate(self, name, iterable):
+        """
+        Charge producing items from an iterable to a phase.
+        """
+        iterator = iter(iterable)
+        while True:
+            self.enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.leave()
+            yield item
+
+    def getSummary(self):
+        return OrderedDict((name, dict(phase)) for name, phase in self.phases.items())
+
+    def formatSummary(self):
+        lines = ['{:<16} {:>10} {:>8} {:>14} {:>14}'.format('phase', 'seconds', 'queries', 'query seconds', 'peak memory')]
+        for name, phase in self.phases.items():
+            lines.append('{:<16} {:>10.3f} {:>8} {:>14.3f} {:>11.1f} MB'.format(
+                name, phase['seconds'], phase['queries'], phase['query_seconds'], phase['peak_memory'] / 1024 / 1024))
+        return '\n'.join(lines)
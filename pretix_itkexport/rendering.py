@@ -0,0 +1,68 @@
+import locale
+
+from django.utils.translation import ugettext_lazy as _
+
+
+class AmountFormatter():
+    """
+    Formats amounts like locale.format('%.2f', amount), but using locale
+    conventions captured on creation, i.e. without depending on the current
+    (process global) locale when formatting.
+    """
+
+    def __init__(self, conventions=None):
+        conventions = conventions if conventions is not None else locale.localeconv()
+        self.decimal_point = conventions['decimal_point']
+
+    def format(self, amount):
+        value = '{:.2f}'.format(amount)
+        return value if '.' == self.decimal_point else value.replace('.', self.decimal_point)
+
+
+class RowRenderer():
+    """
+    Renders amounts and texts for ledger rows.
+
+    Translations are resolved on creation, so a renderer must be created with
+    the language to render in activated.
+    """
+
+    def __init__(self, amount_formatter=None):
+        from pretix_paymentdibs.payment import DIBS
+
+        self.amount_formatter = amount_formatter if amount_formatter is not None else AmountFormatter()
+
+        # Templates by (refund, with card type, with order ids).
+        self.templates = {
+            (False, True, True): str(_('Ticket sale ({card_type}): {order_ids}')),
+            (False, False, True): str(_('Ticket sale: {order_ids}')),
+            (False, True, False): str(_('Ticket sale ({card_type})')),
+            (False, False, False): str(_('Ticket sale')),
+            (True, True, True): str(_('Ticket refund ({card_type}): {order_ids}')),
+            (True, False, True): str(_('Ticket refund: {order_ids}')),
+            (True, True, False): str(_('Ticket refund ({card_type})')),
+            (True, False, False): str(_('Ticket refund')),
+        }
+        self.cash_template = str(_('Cash payment ({user}): {order_id}'))
+
+        self.card_types = {
+            DIBS.CARD_TYPE_CREDIT: str(_('credit')),
+            DIBS.CARD_TYPE_DEBIT: str(_('debit')),
+        }
+
+    def formatAmount(self, amount):
+        return self.amount_formatter.format(amount)
+
+    def localizeCardType(self, card_type):
+        return self.card_types[card_type] if card_type in self.card_types else card_type
+
+    def formatText(self, card_type, order_ids, refund=False):
+        """
+        Format the text for a group of orders (order_ids may be None).
+        """
+        template = self.templates[(refund, card_type is not None, order_ids is not None)]
+        return template.format(card_type=self.localizeCardType(card_type),
+                               order_ids=', '.join(order_ids) if order_ids is not None else None)
+
+    def formatCashText(self, order_id, user):
+        return self.cash_template.format(order_id=order_id, user=user)
@@ -0,0 +1,107 @@
+import hashlib
+import locale
+import pickle
+from datetime import timedelta
+from itertools import chain
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils import translation
+from django.utils.timezone import now
+
+
+class ResultCache():
+    """
+    Cache of export results (rows) for periods that have ended.
+
+    Results are stored in Django's cache (the CACHES setting decides where
+    and how many entries are kept) keyed by the exporter and the settings
+    affecting the rows. A cached result is used only if a fingerprint of the
+    orders in the period (cf. Exporter.getFingerprintOrders), i.e. the
+    number of orders and the latest modification, is unchanged.
+
+    Changes to events and event meta data invalidate all cached results
+    (cf. invalidate).
+
+    Results larger than max_rows rows or max_bytes bytes (pickled) are not
+    cached. Many cache backends reject large items, e.g. Memcached drops
+    items over 1 MB.
+    """
+
+    # Settings that change the rows of an export.
+    key_settings = [
+        'starttime', 'endtime',
+        'debit_artskonto', 'credit_artskonto', 'cash_artskonto',
+        'organizer', 'event', 'event_ids',
+        'aggregation', 'snapshots', 'engine', 'compact_text',
+    ]
+
+    version_key = 'pretix_itkexport_result_cache_version'
+
+    def __init__(self, timeout=timedelta(days=7), max_rows=10000, max_bytes=1000000):
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def invalidate(cls):
+        """
+        Invalidate all cached results.
+        """
+        try:
+            cache.incr(cls.version_key)
+        except ValueError:
+            cache.set(cls.version_key, 1, None)
+
+    def getData(self, exporter, load, **kwargs):
+        """
+        Get data from the cache or by calling load (and cache it).
+
+        Only results of periods that have ended (and not of incremental
+        exports) are cached. Results too large to cache are loaded and
+        returned as an iterator.
+        """
+        if 'endtime' not in kwargs or kwargs['endtime'] > now() or 'watermark' in kwargs:
+            return load()
+
+        key = self.getKey(exporter, **kwargs)
+        # Get the fingerprint before loading, so changes made while loading invalidate the result.
+        fingerprint = self.getFingerprint(exporter, **kwargs)
+
+        cached = cache.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        data = []
+        rows = iter(load())
+        for row in rows:
+            data.append(row)
+            if len(data) > self.max_rows:
+                return chain(data, rows)
+
+        value = pickle.dumps((fingerprint, data), pickle.HIGHEST_PROTOCOL)
+        if len(value) <= self.max_bytes:
+            cache.set(key, (fingerprint, data), self.timeout.total_seconds())
+
+        return data
+
+    def getKey(self, exporter, **kwargs):
+        values = [exporter.__class__.__module__, exporter.__class__.__name__, translation.get_language()]
+        # Amounts are formatted (using the decimal point) when rendering rows.
+        formatter = exporter.amount_formatter
+        values.append(formatter.decimal_point if formatter is not None else locale.localeconv()['decimal_point'])
+        for name in ResultCache.key_settings:
+            value = kwargs[name] if name in kwargs else exporter.settings.get(name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+
+        return 'pretix_itkexport_result_' + hashlib.sha256(repr(values).encode('utf-8')).hexdigest()
+
+    def getFingerprint(self, exporter, **kwargs):
+        fingerprint = exporter.getFingerprintOrders(**kwargs).order_by() \
+            .aggregate(count=Count('pk'), last_modified=Max('last_modified'))
+
+        return (fingerprint['count'], fingerprint['last_modified'], cache.get(ResultCache.version_key, 0))
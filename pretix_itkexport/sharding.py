@@ -0,0 +1,82 @@
+import multiprocessing
+
+from django.db import connections
+from django.db.models import Count
+from django.utils import translation
+from django.utils.module_loading import import_string
+
+
+def initWorker(language):
+    # Never use database connections inherited from the parent process.
+    connections.close_all()
+    translation.activate(language)
+
+
+def exportShard(args):
+    exporter_class, kwargs = args
+    exporter = import_string(exporter_class)()
+    if 'page_size' in kwargs:
+        exporter.page_size = kwargs['page_size']
+    try:
+        return exporter.getPartialData(**kwargs)
+    finally:
+        connections.close_all()
+
+
+class ShardedExport():
+    """
+    Runs an export split by event across a pool of worker processes and
+    merges the partial results (cf. Exporter.getPartialData and
+    Exporter.mergePartialData).
+
+    Events are assigned to shards so that the shards have roughly the same
+    number of orders.
+    """
+
+    def __init__(self, exporter_class, shards=4):
+        # The exporter class as a dotted path (cf. Command.exporter_classes).
+        self.exporter_class = exporter_class
+        self.shards = shards
+
+    def getShards(self, exporter, **kwargs):
+        """
+        Split event ids (of events with orders in the export) into shards of
+        roughly equal size.
+
+        Only orders loaded by the exporter (i.e. in the export scope and
+        period and with the exported statuses) are counted.
+        """
+        event_sizes = exporter.loadOrders(**kwargs).order_by() \
+            .values_list('event_id').annotate(size=Count('pk')).order_by('-size', 'event_id')
+
+        shards = [[] for _index in range(self.shards)]
+        sizes = [0] * self.shards
+        # Assign largest events first to the smallest shard.
+        for event_id, size in event_sizes:
+            index = sizes.index(min(sizes))
+            shards[index].append(event_id)
+            sizes[index] += size
+
+        return [shard for shard in shards if shard]
+
+    def getData(self, exporter, **kwargs):
+        """
+        Get data using an exporter (of the exporter class) for merging.
+        """
+        shards = self.getShards(exporter, **kwargs)
+        if not shards:
+            return exporter.getData(**kwargs)
+
+        jobs = []
+        for event_ids in shards:
+            shard_kwargs = dict(kwargs)
+            shard_kwargs['event_ids'] = event_ids
+            jobs.append((self.exporter_class, shard_kwargs))
+
+        # Worker processes are forked and must not share the parent's database connections.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(processes=len(shards), initializer=initWorker, initargs=(translation.get_language(),)) as pool:
+            parts = pool.map(exportShard, jobs)
+
+        return exporter.mergePartialData(parts, **kwargs)
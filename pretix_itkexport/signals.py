@@ -1 +1,146 @@
 # Register your receivers here
+from datetime import timedelta
+
+import django.conf
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils.timezone import now, utc
+from pretix.base.models.event import Event, EventMetaProperty, EventMetaValue
+from pretix.base.models.log import LogEntry
+from pretix.base.models.orders import Order
+from pretix.base.models.organizer import Organizer
+from pretix.base.signals import periodic_task, register_data_exporters
+
+from .models import LedgerDay, OrderRefund
+from .resultcache import ResultCache
+
+
+@receiver(post_save, sender=LogEntry, dispatch_uid='pretix_itkexport_index_order_refund')
+def index_order_refund(sender, instance, created, **kwargs):
+    if created and instance.action_type == OrderRefund.action_type \
+            and instance.content_type_id == ContentType.objects.get_for_model(Order).id:
+        OrderRefund.index([(instance.id, instance.object_id, instance.datetime)])
+
+
+def is_enabled(name):
+    settings = django.conf.settings.ITK_EXPORT if hasattr(django.conf.settings, 'ITK_EXPORT') else {}
+    return bool(settings.get(name))
+
+
+def snapshots_enabled():
+    """
+    Check if ledger snapshots must be kept up to date, i.e. if snapshots are
+    enabled or have been built (e.g. by itk-export --snapshots).
+    """
+    return is_enabled('snapshots') or LedgerDay.objects.exists()
+
+
+# Snapshots are only invalidated when used. Invalidation is deferred until
+# the changes are committed.
+@receiver(pre_save, sender=Order, dispatch_uid='pretix_itkexport_get_order_payment_date')
+def get_order_payment_date(sender, instance, **kwargs):
+    # Datetimes whose days are invalidated when the order is saved (cf. invalidate_ledger_days_order).
+    instance.itk_invalidate_datetimes = None
+    if not snapshots_enabled():
+        return
+
+    # Changing the payment date changes the day paid before the change, too.
+    instance.itk_invalidate_datetimes = []
+    if instance.pk is not None:
+        instance.itk_invalidate_datetimes.extend(Order.objects.filter(pk=instance.pk).values_list('payment_date', flat=True))
+
+
+@receiver(post_save, sender=Order, dispatch_uid='pretix_itkexport_invalidate_ledger_days_order')
+def invalidate_ledger_days_order(sender, instance, **kwargs):
+    datetimes = getattr(instance, 'itk_invalidate_datetimes', None)
+    if datetimes is None:
+        return
+
+    # Changing an order paid (or refunded) on a closed day invalidates the day's ledger snapshot.
+    order_id = instance.pk
+    datetimes = datetimes + [instance.payment_date]
+    refunded = instance.status == Order.STATUS_REFUNDED
+
+    def invalidate():
+        if refunded:
+            datetimes.extend(OrderRefund.objects.filter(order_id=order_id).values_list('datetime', flat=True))
+        LedgerDay.invalidate(datetimes)
+
+    transaction.on_commit(invalidate)
+
+
+def invalidate_ledger_days_orders(orders):
+    snapshots = snapshots_enabled()
+
+    def invalidate():
+        if snapshots:
+            datetimes = list(orders.filter(payment_date__isnull=False).datetimes('payment_date', 'day', tzinfo=utc))
+            datetimes.extend(OrderRefund.objects.filter(order__in=orders).datetimes('datetime', 'day', tzinfo=utc))
+            LedgerDay.invalidate(datetimes)
+        # The result cache can be used without the setting (cf. itk-export --result-cache), and invalidating is cheap.
+        ResultCache.invalidate()
+
+    transaction.on_commit(invalidate)
+
+
+# The PSP element (event meta data) is part of the ledger snapshots (and of cached results).
+@receiver([post_save, post_delete], sender=EventMetaValue, dispatch_uid='pretix_itkexport_invalidate_ledger_days_event_meta_value')
+def invalidate_ledger_days_event_meta_value(sender, instance, **kwargs):
+    invalidate_ledger_days_orders(Order.objects.filter(event_id=instance.event_id))
+
+
+@receiver([post_save, post_delete], sender=EventMetaProperty, dispatch_uid='pretix_itkexport_invalidate_ledger_days_event_meta_property')
+def invalidate_ledger_days_event_meta_property(sender, instance, **kwargs):
+    invalidate_ledger_days_orders(Order.objects.filter(event__organizer_id=instance.organizer_id))
+
+
+# Event (and organizer) names and dates are part of event exports (and of cached results).
+@receiver([post_save, post_delete], sender=Event, dispatch_uid='pretix_itkexport_invalidate_result_cache_event')
+@receiver([post_save, post_delete], sender=Organizer, dispatch_uid='pretix_itkexport_invalidate_result_cache_organizer')
+def invalidate_result_cache_event(sender, instance, **kwargs):
+    transaction.on_commit(ResultCache.invalidate)
+
+
+@receiver(periodic_task, dispatch_uid='pretix_itkexport_build_ledger_snapshots')
+def build_ledger_snapshots(sender, **kwargs):
+    settings = django.conf.settings.ITK_EXPORT if hasattr(django.conf.settings, 'ITK_EXPORT') else {}
+    if not settings.get('snapshots'):
+        return
+
+    from .exporters import PaidOrdersGroupedExporter
+
+    # Build snapshots for recent closed days.
+    today = LedgerDay.getDay(now())
+    number_of_days = settings['snapshot_days'] if 'snapshot_days' in settings else 31
+    PaidOrdersGroupedExporter().buildSnapshots([today - timedelta(days=index) for index in range(number_of_days, 0, -1)])
+
+
+@receiver(periodic_task, dispatch_uid='pretix_itkexport_deliver_outbox')
+def deliver_outbox(sender, **kwargs):
+    settings = django.conf.settings.ITK_EXPORT if hasattr(django.conf.settings, 'ITK_EXPORT') else {}
+    if not settings.get('outbox'):
+        return
+
+    from .outbox import Outbox
+
+    Outbox.fromSettings(settings).deliver()
+
+
+@receiver(register_data_exporters, dispatch_uid='pretix_itkexport_register_event_exporter')
+def register_event_exporter(sender, **kwargs):
+    from .dataexporters import ITKEventDataExporter
+    return ITKEventDataExporter
+
+
+@receiver(register_data_exporters, dispatch_uid='pretix_itkexport_register_paid_orders_exporter')
+def register_paid_orders_exporter(sender, **kwargs):
+    from .dataexporters import ITKPaidOrdersDataExporter
+    return ITKPaidOrdersDataExporter
+
+
+@receiver(register_data_exporters, dispatch_uid='pretix_itkexport_register_paid_orders_grouped_exporter')
+def register_paid_orders_grouped_exporter(sender, **kwargs):
+    from .dataexporters import ITKPaidOrdersGroupedDataExporter
+    return ITKPaidOrdersGroupedDataExporter
@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.utils.translation import ugettext as _
+
+from .exporters import LedgerLine
+from .rendering import AmountFormatter
+
+
+class ExportSummary():
+    """
+    Summary of an export: the number of (data) rows and, for paid orders
+    exports, the total amount by artskonto and debit/credit and control
+    totals for checking that the ledger balances (cf. isBalanced).
+
+    The summary is collected while the rows are generated (cf. collect)
+    using memory proportional to the number of accounts (not rows).
+    """
+
+    def __init__(self, amount_formatter=None):
+        self.amount_formatter = amount_formatter if amount_formatter is not None else AmountFormatter()
+        self.rows = 0
+        # Totals by (artskonto, debit/credit).
+        self.totals = OrderedDict()
+        # Totals by (artskonto, PSP element, debit/credit).
+        self.account_totals = OrderedDict()
+        # Totals by debit/credit.
+        self.side_totals = OrderedDict([('debet', Decimal(0)), ('kredit', Decimal(0))])
+
+    def collect(self, data):
+        """
+        Collect the summary while passing on rows.
+        """
+        for row in data:
+            if isinstance(row, LedgerLine):
+                self.rows += 1
+                key = (row.artskonto, row.debit_credit)
+                self.totals[key] = self.totals.get(key, Decimal(0)) + row.amount
+                key = (row.artskonto, row.pspelement, row.debit_credit)
+                self.account_totals[key] = self.account_totals.get(key, Decimal(0)) + row.amount
+                self.side_totals[row.debit_credit] += row.amount
+            elif isinstance(row, dict):
+                self.rows += 1
+            yield row
+
+    def getDifference(self):
+        """
+        Get the difference between the debit and credit totals.
+        """
+        return self.side_totals['debet'] - self.side_totals['kredit']
+
+    def isBalanced(self):
+        return self.getDifference() == 0
+
+    def format(self):
+        lines = [_('Number of rows: {rows}').format(rows=self.rows)]
+        if self.totals:
+            lines.append('')
+            lines.append(_('Totals by artskonto:'))
+            for (artskonto, debit_credit), amount in self.totals.items():
+                lines.append('{} {:<6} {:>16}'.format(artskonto, debit_credit, self.amount_formatter.format(amount)))
+
+            lines.append('')
+            lines.append(_('Totals by artskonto and PSP element:'))
+            for (artskonto, pspelement, debit_credit), amount in self.account_totals.items():
+                lines.append('{} {} {:<6} {:>16}'.format(artskonto, pspelement if pspelement is not None else '-', debit_credit,
+                                                         self.amount_formatter.format(amount)))
+
+            lines.append('')
+            lines.append(_('Control totals:'))
+            for debit_credit, amount in self.side_totals.items():
+                lines.append('{:<6} {:>16}'.format(debit_credit, self.amount_formatter.format(amount)))
+            if not self.isBalanced():
+                lines.append(self.formatImbalance())
+        return '\n'.join(lines)
+
+    def formatImbalance(self):
+        return _('The ledger does not balance (difference: {difference})').format(
+            difference=self.amount_formatter.format(self.getDifference()))
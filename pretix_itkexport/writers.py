@@ -0,0 +1,121 @@
+from datetime import datetime
+from decimal import Decimal
+from itertools import chain
+
+from .exporters import LedgerLine, PaidOrdersExporter
+
+
+class ArrowWriter():
+    """
+    Writes export rows as typed columns in Apache Parquet or Arrow (IPC file)
+    format.
+
+    Rows are either a header row followed by ledger lines (paid orders
+    exports) or dicts (event export). Amounts are written as decimals,
+    datetimes as (UTC) timestamps and everything else as strings.
+
+    Rows are converted and written in batches, so memory use is bounded by
+    the batch size rather than the size of the export.
+
+    Requires pyarrow (pip install pyarrow).
+    """
+
+    formats = ['parquet', 'arrow']
+
+    content_types = {
+        'parquet': 'application/vnd.apache.parquet',
+        'arrow': 'application/vnd.apache.arrow.file',
+    }
+
+    amount_exponent = Decimal('0.01')
+
+    def __init__(self, output, output_format, batch_size=10000):
+        if output_format not in self.formats:
+            raise Exception('Invalid format: {}'.format(output_format))
+
+        try:
+            import pyarrow
+        except ImportError:
+            raise Exception('Writing {} files requires pyarrow (pip install pyarrow)'.format(output_format))
+
+        self.pyarrow = pyarrow
+        self.output = output
+        self.output_format = output_format
+        self.batch_size = batch_size
+        self.schema = None
+        self.writer = None
+
+    def write(self, data):
+        """
+        Write all rows and return the number of (data) rows written.
+        """
+        iterator = iter(data)
+        first = next(iterator, None)
+
+        if first is None:
+            self.open([])
+            self.close()
+            return 0
+
+        if isinstance(first, dict):
+            names = list(first.keys())
+            types = [self.getType(value) for value in first.values()]
+            rows = chain([first], iterator)
+        else:
+            # The first row is a header row.
+            names = list(first)
+            types = [self.getType(Decimal(0) if index == PaidOrdersExporter.index_amount else None)
+                     for index in range(len(names))]
+            rows = iterator
+
+        self.open(list(zip(names, types)))
+
+        number_of_rows = 0
+        batch = []
+        for row in rows:
+            batch.append(list(row.values()) if isinstance(row, (dict, LedgerLine)) else list(row))
+            if len(batch) >= self.batch_size:
+                self.writeBatch(batch, types)
+                number_of_rows += len(batch)
+                batch = []
+        if batch:
+            self.writeBatch(batch, types)
+            number_of_rows += len(batch)
+
+        self.close()
+
+        return number_of_rows
+
+    def getType(self, value):
+        pyarrow = self.pyarrow
+        if isinstance(value, (Decimal, float)):
+            return pyarrow.decimal128(18, 2)
+        if isinstance(value, datetime):
+            return pyarrow.timestamp('us', tz='UTC')
+        return pyarrow.string()
+
+    def convert(self, value, column_type):
+        if value is None:
+            return None
+        if self.pyarrow.types.is_decimal(column_type):
+            return Decimal(value).quantize(self.amount_exponent)
+        if self.pyarrow.types.is_timestamp(column_type):
+            return value
+        return str(value)
+
+    def open(self, columns):
+        pyarrow = self.pyarrow
+        self.schema = pyarrow.schema([pyarrow.field(name, column_type) for name, column_type in columns])
+        if 'parquet' == self.output_format:
+            import pyarrow.parquet
+            self.writer = pyarrow.parquet.ParquetWriter(self.output, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_file(self.output, self.schema)
+
+    def writeBatch(self, batch, types):
+        arrays = [self.pyarrow.array([self.convert(row[index], column_type) for row in batch], type=column_type)
+                  for index, column_type in enumerate(types)]
+        self.writer.write_table(self.pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
@@ -0,0 +1,22 @@
+import pytest
+from pretix_itkexport.benchmark import Benchmark
+
+
+@pytest.fixture(autouse=True)
+def itk_export_settings(settings):
+    settings.ITK_EXPORT = dict(Benchmark.settings)
+    return settings.ITK_EXPORT
+
+
+@pytest.fixture
+def create_orders(db):
+    """
+    Create (benchmark) fixtures with a number of orders spread over a number of events.
+    """
+    def create(number_of_orders, number_of_events=5):
+        benchmark = Benchmark()
+        benchmark.event_size = max(1, number_of_orders // number_of_events)
+        benchmark.createFixtures(number_of_orders)
+        return benchmark
+
+    return create
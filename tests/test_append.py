@@ -0,0 +1,36 @@
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from pretix_itkexport.models import ExportWatermark
+from pretix_itkexport.summary import ExportSummary
+
+
+def export(benchmark, path, *args):
+    call_command('itk-export', 'paid-orders', '--starttime', benchmark.starttime.date().isoformat(),
+                 '--endtime', benchmark.endtime.date().isoformat(), '--append', str(path), *args)
+
+
+def test_rows_are_appended(create_orders, tmpdir):
+    benchmark = create_orders(50)
+    path = tmpdir.join('ledger.csv')
+
+    export(benchmark, path)
+    lines = path.read_text('utf-8').splitlines()
+    export(benchmark, path)
+
+    # The header row is written only once.
+    assert len(lines) > 1
+    assert path.read_text('utf-8').splitlines() == lines + lines[1:]
+
+
+def test_unbalanced_rows_are_not_appended(create_orders, tmpdir, monkeypatch):
+    benchmark = create_orders(50)
+    path = tmpdir.join('ledger.csv')
+    path.write('')
+    monkeypatch.setattr(ExportSummary, 'isBalanced', lambda summary: False)
+
+    with pytest.raises(CommandError):
+        export(benchmark, path, '--balance-check', 'fail', '--incremental')
+
+    assert path.read_text('utf-8') == ''
+    assert not ExportWatermark.objects.filter(payment_date__isnull=False).exists()
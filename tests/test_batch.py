@@ -0,0 +1,62 @@
+import importlib
+from datetime import datetime
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils.timezone import utc
+
+Command = importlib.import_module('pretix_itkexport.management.commands.itk-export').Command
+
+
+def d(*args):
+    return datetime(*args, tzinfo=utc)
+
+
+@pytest.mark.parametrize('option', [['--info'], ['--incremental'], ['--shards', '2'], ['--explain'], ['--profile']])
+def test_batch_rejects_unsupported_options(option):
+    with pytest.raises(CommandError, match='Batch does not support'):
+        call_command('itk-export', 'batch', *option)
+
+
+def test_batch_rejects_unsupported_options_in_jobs(tmpdir):
+    jobs = tmpdir.join('jobs.yaml')
+    jobs.write('- export_type: paid-orders\n  incremental: true\n')
+
+    with pytest.raises(CommandError, match='Batch does not support --incremental'):
+        call_command('itk-export', 'batch', '--jobs', str(jobs))
+
+
+def test_jobs_with_overlapping_periods_share_order_caches():
+    jobs = [
+        {'export_type': 'paid-orders', 'starttime': d(2018, 1, 1), 'endtime': d(2018, 2, 1)},
+        {'export_type': 'paid-orders-grouped', 'starttime': d(2018, 6, 1), 'endtime': d(2018, 7, 1)},
+        {'export_type': 'paid-orders-grouped', 'starttime': d(2018, 1, 15), 'endtime': d(2018, 3, 1)},
+        {'export_type': 'event', 'starttime': d(2018, 1, 1), 'endtime': d(2019, 1, 1)},
+        {'export_type': 'paid-orders', 'starttime': d(2018, 3, 1), 'endtime': d(2018, 4, 1)},
+    ]
+
+    order_caches = Command().getOrderCaches(jobs)
+
+    assert order_caches[0] is order_caches[2]
+    assert order_caches[0].period == {'starttime': d(2018, 1, 1), 'endtime': d(2018, 3, 1)}
+    assert order_caches[1].period == {'starttime': d(2018, 6, 1), 'endtime': d(2018, 7, 1)}
+    assert order_caches[3] is None
+    assert order_caches[4].period == {'starttime': d(2018, 3, 1), 'endtime': d(2018, 4, 1)}
+    assert len({id(order_cache) for order_cache in order_caches}) == 4
+
+
+def test_jobs_without_period_share_order_caches():
+    jobs = [
+        {'export_type': 'paid-orders', 'starttime': d(2018, 6, 1)},
+        {'export_type': 'paid-orders', 'endtime': d(2018, 2, 1)},
+        {'export_type': 'paid-orders', 'starttime': d(2018, 1, 1), 'endtime': d(2018, 3, 1)},
+        {'export_type': 'paid-orders', 'starttime': d(2018, 4, 1), 'endtime': d(2018, 5, 1)},
+    ]
+
+    order_caches = Command().getOrderCaches(jobs)
+
+    assert order_caches[1] is order_caches[2]
+    assert order_caches[1].period == {'endtime': d(2018, 3, 1)}
+    assert order_caches[3].period == {'starttime': d(2018, 4, 1), 'endtime': d(2018, 5, 1)}
+    assert order_caches[0].period == {'starttime': d(2018, 6, 1)}
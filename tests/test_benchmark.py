@@ -0,0 +1,24 @@
+from datetime import date, timedelta
+
+from pretix_itkexport.benchmark import Benchmark
+from pretix_itkexport.models import LedgerDay
+
+
+def test_fixtures_do_not_invalidate_snapshots(create_orders):
+    # Benchmark orders are paid and refunded in 2018.
+    LedgerDay.objects.bulk_create([LedgerDay(day=date(2018, 1, 1) + timedelta(days=index), fingerprint='') for index in range(366)])
+    create_orders(200)
+
+    assert LedgerDay.objects.count() == 366
+
+
+def test_run_exports_benchmark_orders_only(create_orders):
+    benchmark = create_orders(50)
+    rows = {name: result['rows'] for name, result in benchmark.run().items()}
+
+    other = Benchmark(seed=1)
+    other.organizer_slug = 'itk-export-benchmark-other'
+    other.event_size = 10
+    other.createFixtures(50)
+
+    assert {name: result['rows'] for name, result in benchmark.run().items()} == rows
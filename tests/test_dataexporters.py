@@ -0,0 +1,35 @@
+from django.utils import translation
+from pretix.base.models.event import Event
+from pretix_itkexport.dataexporters import (
+    ITKPaidOrdersDataExporter, ITKPaidOrdersGroupedDataExporter,
+)
+
+
+def test_cache_key_depends_on_language_and_decimal_separator(create_orders, settings):
+    benchmark = create_orders(10, number_of_events=1)
+    exporter = ITKPaidOrdersGroupedDataExporter(Event.objects.get())
+    export_settings = {'starttime': benchmark.starttime, 'endtime': benchmark.endtime}
+
+    settings.USE_L10N = False
+    with translation.override('en'):
+        key = exporter.getCacheKey(export_settings)
+        assert exporter.getCacheKey(export_settings) == key
+        settings.DECIMAL_SEPARATOR = ','
+        assert exporter.getCacheKey(export_settings) != key
+    with translation.override('da'):
+        assert exporter.getCacheKey(export_settings) != key
+
+
+def test_progress_is_reported_while_rows_are_written(create_orders):
+    benchmark = create_orders(500, number_of_events=1)
+    exporter = ITKPaidOrdersDataExporter(Event.objects.get())
+    exporter.progress_interval = 50
+    progress = []
+    exporter.progress_callback = progress.append
+
+    exporter.render({'starttime': benchmark.starttime.date(), 'endtime': benchmark.endtime.date()})
+
+    assert progress[0] == 0
+    assert progress[-1] == 100
+    assert len(progress) > 10
+    assert progress == sorted(progress)
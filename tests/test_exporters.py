@@ -0,0 +1,142 @@
+from datetime import timedelta
+
+import pytest
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from pretix.base.models.log import LogEntry
+from pretix.base.models.orders import Order
+from pretix_itkexport.benchmark import Benchmark
+from pretix_itkexport.exporters import (
+    PaidOrdersExporter, PaidOrdersGroupedExporter, PaidOrdersLineExporter,
+)
+from pretix_itkexport.models import ExportWatermark, OrderRefund
+
+
+def getQueryCount(benchmark, exporter_class, exporter_settings):
+    exporter = exporter_class()
+    with CaptureQueriesContext(connection) as queries:
+        list(exporter.getData(starttime=benchmark.starttime, endtime=benchmark.endtime, **exporter_settings))
+    return len(queries)
+
+
+# Loading orders in pages uses a query per page.
+@pytest.mark.parametrize('name,exporter_class,exporter_settings', [case for case in Benchmark.cases if 'page_size' not in case[2]])
+def test_query_count_does_not_depend_on_number_of_orders(create_orders, monkeypatch, name, exporter_class, exporter_settings):
+    # Read orders in a number of batches (cf. Exporter.streamEventMetaData).
+    monkeypatch.setattr(exporter_class, 'event_meta_data_batch_size', 20)
+    counts = []
+    for number_of_orders in [50, 500]:
+        benchmark = create_orders(number_of_orders)
+        counts.append(getQueryCount(benchmark, exporter_class, exporter_settings))
+
+    assert counts[0] == counts[1]
+
+
+@pytest.mark.parametrize('name,exporter_class,exporter_settings',
+                         [case for case in Benchmark.cases if case[0] in ['event', 'event (columnar engine)', 'paid-orders', 'paid-orders-grouped']])
+def test_orders_are_queried_once(create_orders, name, exporter_class, exporter_settings):
+    benchmark = create_orders(50)
+    exporter = exporter_class()
+    with CaptureQueriesContext(connection) as queries:
+        list(exporter.getData(starttime=benchmark.starttime, endtime=benchmark.endtime, **exporter_settings))
+
+    assert 1 == len([query for query in queries if '"pretixbase_order"' in query['sql']])
+
+
+def getLedger(exporter, benchmark, **kwargs):
+    """
+    Get ledger lines as a multiset of (artskonto, pspelement, debit/credit, amount, text prefix, order ids) (order ids sorted).
+    """
+    lines = []
+    for line in list(exporter.getData(starttime=benchmark.starttime, endtime=benchmark.endtime, **kwargs))[1:]:
+        prefix, _separator, order_ids = line.text.partition(': ')
+        lines.append((line.artskonto, line.pspelement, line.debit_credit, line.amount, prefix, tuple(sorted(order_ids.split(', ')))))
+    return sorted(lines, key=repr)
+
+
+@pytest.mark.parametrize('compact_text', [False, True])
+def test_database_aggregation_matches_python_aggregation(create_orders, compact_text):
+    benchmark = create_orders(500)
+
+    python_ledger = getLedger(PaidOrdersGroupedExporter(), benchmark, compact_text=compact_text)
+    database_ledger = getLedger(PaidOrdersGroupedExporter(), benchmark, compact_text=compact_text, aggregation='database')
+
+    assert python_ledger
+    assert python_ledger == database_ledger
+
+
+def test_orders_refunded_twice_are_counted_once(create_orders):
+    benchmark = create_orders(500)
+    # Refund some orders again a day later.
+    refunds = list(OrderRefund.objects.order_by('pk')[:5])
+    logentries = LogEntry.objects.bulk_create([LogEntry(content_type=ContentType.objects.get_for_model(Order), object_id=refund.order_id,
+                                                        action_type=OrderRefund.action_type) for refund in refunds])
+    logentry_ids = LogEntry.objects.filter(action_type=OrderRefund.action_type).order_by('-pk').values_list('pk', flat=True)[:len(logentries)]
+    OrderRefund.index([(logentry_id, refund.order_id, refund.datetime + timedelta(days=1))
+                       for logentry_id, refund in zip(logentry_ids, refunds)], invalidate=False)
+
+    python_ledger = getLedger(PaidOrdersGroupedExporter(), benchmark)
+    refunded_orders = list(PaidOrdersExporter().loadRefundedOrders(starttime=benchmark.starttime, endtime=benchmark.endtime))
+
+    assert len(refunded_orders) == len({order.pk for order in refunded_orders})
+    assert getLedger(PaidOrdersGroupedExporter(), benchmark, aggregation='database') == python_ledger
+
+
+def test_orders_refunded_in_period_are_loaded(create_orders):
+    benchmark = create_orders(500)
+    starttime = benchmark.starttime + timedelta(days=100)
+    endtime = starttime + timedelta(days=30)
+
+    orders = PaidOrdersLineExporter().loadOrders(starttime=starttime, endtime=endtime)
+    refunds = OrderRefund.objects.filter(datetime__gte=starttime, datetime__lt=endtime)
+
+    assert refunds.exists()
+    assert {order.pk: (order.refund_date, order.refund_id) for order in orders if order.refund_date is not None} \
+        == {refund.order_id: (refund.datetime, refund.pk) for refund in refunds}
+    assert all(order.refund_id is None for order in orders if order.status == Order.STATUS_PAID)
+
+
+def exportRefunds(watermark, endtime):
+    """
+    Run an incremental export and get the ids of the refunds exported.
+    """
+    exporter = PaidOrdersLineExporter()
+    refunded_orders = []
+    list(exporter.splitOrders(exporter.loadOrders(endtime=endtime, watermark=watermark), refunded_orders, [], endtime=endtime, watermark=watermark))
+    watermark.update(exporter.getWatermark())
+    return {order.refund_id for order in refunded_orders}
+
+
+def test_refunds_indexed_after_incremental_export(create_orders):
+    benchmark = create_orders(500)
+    refunds = list(OrderRefund.objects.order_by('datetime', 'pk'))
+    backfilled, late = refunds[0], refunds[-1]
+    OrderRefund.objects.filter(pk__in=[backfilled.pk, late.pk]).delete()
+    watermark = ExportWatermark.objects.create(export_type='paid-orders')
+
+    assert exportRefunds(watermark, benchmark.endtime) == {refund.pk for refund in refunds[1:-1]}
+
+    # A refund made before the watermark is indexed (with a new pk) ...
+    OrderRefund.index([(backfilled.logentry_id, backfilled.order_id, backfilled.datetime)], invalidate=False)
+    # ... and a refund made after the watermark is committed with a smaller pk.
+    late = OrderRefund.objects.create(pk=backfilled.pk, order_id=late.order_id, logentry_id=late.logentry_id,
+                                      datetime=watermark.refund_date + timedelta(hours=1))
+
+    assert late.datetime < benchmark.endtime
+    assert exportRefunds(watermark, benchmark.endtime) == {late.pk}
+    assert exportRefunds(watermark, benchmark.endtime) == set()
+
+
+@pytest.mark.parametrize('compact_text', [False, True])
+def test_database_aggregation_sums_credit_amounts_in_database(create_orders, compact_text):
+    benchmark = create_orders(50)
+    with CaptureQueriesContext(connection) as queries:
+        list(PaidOrdersGroupedExporter().getData(starttime=benchmark.starttime, endtime=benchmark.endtime,
+                                                 aggregation='database', compact_text=compact_text))
+
+    order_queries = [query['sql'] for query in queries if 'FROM "pretixbase_order"' in query['sql']]
+    # Paid and refunded orders are read once for debit amounts and summed once for credit amounts (cash orders once).
+    assert 2 == len([sql for sql in order_queries if 'SUM("pretixbase_order"."total")' in sql])
+    # Order codes are only read for texts.
+    assert compact_text != any('"pretixbase_order"."code"' in sql for sql in order_queries if 'SUM(' not in sql and 'dibs' in sql)
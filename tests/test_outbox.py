@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend
+from django.utils.timezone import now
+from pretix_itkexport.models import OutboxMessage
+from pretix_itkexport.outbox import Outbox
+
+
+class UnavailableEmailBackend(EmailBackend):
+    def open(self):
+        raise ConnectionRefusedError('Connection refused')
+
+
+class CheckingEmailBackend(EmailBackend):
+    """
+    Checks that messages are claimed (and the claim committed) before they are sent.
+    """
+
+    def send_messages(self, messages):
+        for message in messages:
+            assert OutboxMessage.objects.get(subject=message.subject).next_attempt > now()
+        return super().send_messages(messages)
+
+
+def addMessages(outbox, number_of_messages):
+    return outbox.add([EmailMessage(subject='Export {}'.format(index), body='', to=['test@example.com'])
+                       for index in range(number_of_messages)])
+
+
+def test_deliver(db):
+    outbox = Outbox(batch_size=2)
+    addMessages(outbox, 3)
+
+    assert outbox.deliver(CheckingEmailBackend()) == (3, 0)
+    assert not OutboxMessage.objects.filter(sent__isnull=True).exists()
+    assert not OutboxMessage.objects.filter(next_attempt__isnull=False).exists()
+
+
+def test_deliver_retries_messages_when_connection_fails(db):
+    outbox = Outbox(batch_size=2, max_attempts=2)
+    addMessages(outbox, 3)
+
+    start = now()
+    assert outbox.deliver(UnavailableEmailBackend()) == (0, 3)
+    for outbox_message in OutboxMessage.objects.all():
+        assert outbox_message.attempts == 1
+        assert outbox_message.error == 'Connection refused'
+        assert outbox_message.next_attempt >= start + outbox.getRetryDelay(1)
+        assert outbox_message.next_attempt < start + timedelta(minutes=5)
+
+    # Messages failing in a run are not retried in the same run.
+    assert outbox.deliver(UnavailableEmailBackend()) == (0, 0)
+
+    OutboxMessage.objects.update(next_attempt=now())
+    assert outbox.deliver(UnavailableEmailBackend()) == (0, 3)
+    assert not OutboxMessage.objects.filter(next_attempt__isnull=False).exists()
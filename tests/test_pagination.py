@@ -0,0 +1,58 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from pretix.base.models.orders import Order
+from pretix_itkexport.exporters import EventExporter, PaidOrdersExporter
+
+# (exporter class, loader, ordering fields)
+loaders = [
+    (EventExporter, 'loadOrders', ['datetime']),
+    (PaidOrdersExporter, 'loadOrders', ['payment_date', 'refund_date', 'refund_id']),
+    (PaidOrdersExporter, 'loadPaidOrders', ['payment_date']),
+    (PaidOrdersExporter, 'loadRefundedOrders', ['refund_date']),
+    (PaidOrdersExporter, 'loadCashOrders', ['payment_date']),
+]
+
+
+@pytest.fixture
+def orders(create_orders):
+    benchmark = create_orders(300)
+    order_ids = list(Order.objects.order_by('pk').values_list('pk', flat=True))
+    # Orders without a payment date (first when paginating) and orders with the same payment date and datetime.
+    Order.objects.filter(pk__in=order_ids[::20]).update(payment_date=None)
+    Order.objects.filter(pk__in=order_ids[1::7]).update(payment_date=benchmark.starttime, datetime=benchmark.starttime)
+    return benchmark
+
+
+def getRows(exporter, loader, fields, page_size, **kwargs):
+    exporter.page_size = page_size
+    return [(order.pk,) + tuple(getattr(order, field) for field in fields)
+            for order in exporter.iterate(getattr(exporter, loader)(**kwargs))]
+
+
+@pytest.mark.parametrize('exporter_class, loader, fields', loaders)
+@pytest.mark.parametrize('period', [False, True])
+@pytest.mark.parametrize('page_size', [1, 7, 1000])
+def test_pages_give_same_orders(orders, exporter_class, loader, fields, period, page_size):
+    kwargs = {'starttime': orders.starttime, 'endtime': orders.endtime} if period else {}
+    exporter = exporter_class()
+
+    rows = getRows(exporter, loader, fields, None, **kwargs)
+    assert rows
+    assert getRows(exporter, loader, fields, page_size, **kwargs) == rows
+
+
+@pytest.mark.parametrize('exporter_class, loader, fields', loaders)
+@pytest.mark.parametrize('page_size', [1, 7])
+def test_pages_are_limited(orders, exporter_class, loader, fields, page_size):
+    exporter = exporter_class()
+    exporter.page_size = page_size
+
+    with CaptureQueriesContext(connection) as queries:
+        rows = list(exporter.iterate(getattr(exporter, loader)()))
+    pages = [query['sql'] for query in queries if query['sql'].startswith('SELECT') and ' FROM "pretixbase_order" ' in query['sql']]
+
+    # Each page is fetched by a query selecting at most page_size rows.
+    assert rows
+    assert all(sql.endswith(' LIMIT {}'.format(page_size)) for sql in pages)
+    assert len(pages) >= len(rows) / page_size
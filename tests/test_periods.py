@@ -0,0 +1,64 @@
+from datetime import date, datetime
+
+import pytest
+from django.utils.timezone import utc
+from pretix_itkexport.periods import resolvePeriod
+
+
+def d(*args):
+    return datetime(*args, tzinfo=utc)
+
+
+@pytest.mark.parametrize('period,today,expected', [
+    # New year (Monday)
+    ('current-year', date(2018, 1, 1), (d(2018, 1, 1), d(2019, 1, 1))),
+    ('previous-year', date(2018, 1, 1), (d(2017, 1, 1), d(2018, 1, 1))),
+    ('current-month', date(2018, 1, 1), (d(2018, 1, 1), d(2018, 2, 1))),
+    ('previous-month', date(2018, 1, 1), (d(2017, 12, 1), d(2018, 1, 1))),
+    ('current-week', date(2018, 1, 1), (d(2018, 1, 1), d(2018, 1, 8))),
+    ('previous-week', date(2018, 1, 1), (d(2017, 12, 25), d(2018, 1, 1))),
+    ('previous-week+3', date(2018, 1, 1), (d(2017, 12, 28), d(2018, 1, 4))),
+    ('previous-week-2', date(2018, 1, 1), (d(2017, 12, 23), d(2017, 12, 30))),
+    ('current-day', date(2018, 1, 1), (d(2018, 1, 1), d(2018, 1, 2))),
+    ('today', date(2018, 1, 1), (d(2018, 1, 1), d(2018, 1, 2))),
+    ('previous-day', date(2018, 1, 1), (d(2017, 12, 31), d(2018, 1, 1))),
+    ('yesterday', date(2018, 1, 1), (d(2017, 12, 31), d(2018, 1, 1))),
+    # New year's eve (Sunday)
+    ('current-year', date(2017, 12, 31), (d(2017, 1, 1), d(2018, 1, 1))),
+    ('current-month', date(2017, 12, 31), (d(2017, 12, 1), d(2018, 1, 1))),
+    ('previous-month', date(2017, 12, 31), (d(2017, 11, 1), d(2017, 12, 1))),
+    ('current-week', date(2017, 12, 31), (d(2017, 12, 25), d(2018, 1, 1))),
+    ('previous-week', date(2017, 12, 31), (d(2017, 12, 18), d(2017, 12, 25))),
+    ('previous-week+7', date(2017, 12, 31), (d(2017, 12, 25), d(2018, 1, 1))),
+    ('today', date(2017, 12, 31), (d(2017, 12, 31), d(2018, 1, 1))),
+    # February
+    ('current-month', date(2019, 2, 28), (d(2019, 2, 1), d(2019, 3, 1))),
+    ('today', date(2019, 2, 28), (d(2019, 2, 28), d(2019, 3, 1))),
+    ('previous-week', date(2019, 2, 28), (d(2019, 2, 18), d(2019, 2, 25))),
+    ('previous-month', date(2020, 3, 1), (d(2020, 2, 1), d(2020, 3, 1))),
+    ('yesterday', date(2020, 3, 1), (d(2020, 2, 29), d(2020, 3, 1))),
+    ('current-week', date(2020, 3, 1), (d(2020, 2, 24), d(2020, 3, 2))),
+    ('previous-week-1', date(2020, 3, 2), (d(2020, 2, 23), d(2020, 3, 1))),
+    # Start of daylight saving time (last Sunday in March)
+    ('today', date(2018, 3, 25), (d(2018, 3, 25), d(2018, 3, 26))),
+    ('yesterday', date(2018, 3, 26), (d(2018, 3, 25), d(2018, 3, 26))),
+    ('current-week', date(2018, 3, 25), (d(2018, 3, 19), d(2018, 3, 26))),
+    ('previous-week', date(2018, 3, 26), (d(2018, 3, 19), d(2018, 3, 26))),
+    ('previous-week+1', date(2018, 3, 26), (d(2018, 3, 20), d(2018, 3, 27))),
+    ('current-month', date(2018, 3, 25), (d(2018, 3, 1), d(2018, 4, 1))),
+    # End of daylight saving time (last Sunday in October)
+    ('today', date(2018, 10, 28), (d(2018, 10, 28), d(2018, 10, 29))),
+    ('previous-day', date(2018, 10, 29), (d(2018, 10, 28), d(2018, 10, 29))),
+    ('current-week', date(2018, 10, 28), (d(2018, 10, 22), d(2018, 10, 29))),
+    ('previous-week', date(2018, 10, 29), (d(2018, 10, 22), d(2018, 10, 29))),
+    ('previous-week-6', date(2018, 10, 29), (d(2018, 10, 16), d(2018, 10, 23))),
+    ('previous-month', date(2018, 11, 1), (d(2018, 10, 1), d(2018, 11, 1))),
+])
+def test_resolve_period(period, today, expected):
+    assert resolvePeriod(period, today=today) == expected
+
+
+@pytest.mark.parametrize('period', ['next-month', 'previous-week+', 'previous-weekly', ''])
+def test_resolve_invalid_period(period):
+    with pytest.raises(ValueError):
+        resolvePeriod(period, today=date(2018, 1, 1))
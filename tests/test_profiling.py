@@ -0,0 +1,38 @@
+from django.db import connection
+from pretix.base.models.orders import Order
+from pretix_itkexport.profiling import Profiler
+
+
+def test_queries_are_counted_when_query_log_is_full(db):
+    profiler = Profiler()
+    profiler.start()
+    try:
+        connection.queries_log.extend({'sql': '', 'time': '0.000'} for _index in range(connection.queries_log.maxlen))
+        for count in [3, 5]:
+            with profiler.phase('queries {}'.format(count)):
+                for _index in range(count):
+                    Order.objects.exists()
+    finally:
+        profiler.stop()
+        connection.queries_log.clear()
+
+    summary = profiler.getSummary()
+    assert summary['queries 3']['queries'] == 3
+    assert summary['queries 5']['queries'] == 5
+
+
+def test_peak_memory_is_relative_to_phase_entry():
+    profiler = Profiler()
+    profiler.start()
+    try:
+        with profiler.phase('large'):
+            data = bytearray(10 * 1024 * 1024)
+        del data
+        with profiler.phase('small'):
+            bytearray(1024)
+    finally:
+        profiler.stop()
+
+    summary = profiler.getSummary()
+    assert summary['large']['peak_memory'] >= 10 * 1024 * 1024
+    assert summary['small']['peak_memory'] < 1024 * 1024
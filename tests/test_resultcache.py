@@ -0,0 +1,73 @@
+import pytest
+from pretix.base.models.event import Event, EventMetaValue
+from pretix_itkexport.exporters import (
+    EventExporter, PaidOrdersGroupedExporter, PaidOrdersLineExporter,
+)
+from pretix_itkexport.resultcache import ResultCache
+
+
+@pytest.fixture(autouse=True)
+def locmem_cache(settings):
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def getData(result_cache, exporter, benchmark):
+    kwargs = {'starttime': benchmark.starttime, 'endtime': benchmark.endtime}
+    # Ledger lines are compared by their representation.
+    return [repr(row) for row in result_cache.getData(exporter, lambda: exporter.getData(**kwargs), **kwargs)]
+
+
+def test_results_are_cached(create_orders):
+    benchmark = create_orders(100)
+    result_cache = ResultCache()
+    exporter = PaidOrdersLineExporter()
+
+    data = getData(result_cache, exporter, benchmark)
+    assert getData(result_cache, exporter, benchmark) == data
+    assert (result_cache.hits, result_cache.misses) == (1, 1)
+
+
+@pytest.mark.parametrize('limit', [{'max_rows': 10}, {'max_bytes': 1000}])
+def test_large_results_are_not_cached(create_orders, limit):
+    benchmark = create_orders(100)
+    result_cache = ResultCache(**limit)
+    exporter = PaidOrdersLineExporter()
+
+    data = getData(result_cache, exporter, benchmark)
+    assert len(data) == len(list(exporter.getData(starttime=benchmark.starttime, endtime=benchmark.endtime)))
+    assert getData(result_cache, exporter, benchmark) == data
+    assert (result_cache.hits, result_cache.misses) == (0, 2)
+
+
+# Results are invalidated when changes are committed (even if the result cache is only enabled on the command line).
+@pytest.mark.django_db(transaction=True)
+def test_changing_events_invalidates_results(create_orders):
+    benchmark = create_orders(100)
+    result_cache = ResultCache()
+    exporter = EventExporter()
+
+    getData(result_cache, exporter, benchmark)
+    event = Event.objects.order_by('pk').first()
+    event.name = 'Renamed event'
+    event.save()
+
+    data = getData(result_cache, exporter, benchmark)
+    assert (result_cache.hits, result_cache.misses) == (0, 2)
+    assert any('Renamed event' in row for row in data)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_changing_event_meta_data_invalidates_results(create_orders):
+    benchmark = create_orders(100)
+    result_cache = ResultCache()
+    exporter = PaidOrdersGroupedExporter()
+
+    getData(result_cache, exporter, benchmark)
+    meta_value = EventMetaValue.objects.filter(property__name='PSP').order_by('pk').first()
+    meta_value.value = 'XG-CHANGED'
+    meta_value.save()
+
+    # Exporters keep the event meta data loaded.
+    data = getData(result_cache, PaidOrdersGroupedExporter(), benchmark)
+    assert (result_cache.hits, result_cache.misses) == (0, 2)
+    assert any('XG-CHANGED' in row for row in data)
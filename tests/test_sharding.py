@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+import pytest
+from pretix_itkexport.exporters import EventExporter, PaidOrdersGroupedExporter
+from pretix_itkexport.sharding import ShardedExport
+
+
+@pytest.mark.parametrize('exporter_class', [EventExporter, PaidOrdersGroupedExporter])
+def test_shards_contain_events_with_orders_in_period(create_orders, exporter_class):
+    benchmark = create_orders(500, number_of_events=50)
+    kwargs = {'starttime': benchmark.starttime, 'endtime': benchmark.starttime + timedelta(days=7)}
+    exporter = exporter_class()
+
+    shards = ShardedExport(exporter_class.__module__ + '.' + exporter_class.__name__).getShards(exporter, **kwargs)
+    event_ids = [event_id for shard in shards for event_id in shard]
+
+    assert event_ids
+    assert sorted(event_ids) == sorted(set(exporter.loadOrders(**kwargs).values_list('event_id', flat=True)))
+    assert len(event_ids) < 50
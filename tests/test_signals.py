@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+import pytest
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from pretix.base.models.orders import Order
+from pretix_itkexport.exporters import PaidOrdersGroupedExporter
+from pretix_itkexport.models import LedgerDay
+
+
+@pytest.fixture
+def snapshot(create_orders):
+    create_orders(20)
+    order = Order.objects.filter(status=Order.STATUS_PAID, payment_provider='dibs').order_by('pk').first()
+    PaidOrdersGroupedExporter().buildSnapshots([LedgerDay.getDay(order.payment_date)])
+    return order
+
+
+def test_orders_are_saved_without_invalidation_when_snapshots_are_not_used(create_orders):
+    create_orders(20)
+    order = Order.objects.order_by('pk').first()
+
+    with CaptureQueriesContext(connection) as queries:
+        order.save()
+
+    # Saving the order and checking for snapshots.
+    assert len(queries) == 2
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('enabled', [False, True])
+def test_snapshots_are_invalidated_on_commit(snapshot, itk_export_settings, enabled):
+    # Snapshots built (e.g. by itk-export --snapshots) are invalidated even if the setting is not enabled.
+    itk_export_settings['snapshots'] = enabled
+
+    with transaction.atomic():
+        snapshot.save()
+        assert LedgerDay.objects.exists()
+
+    assert not LedgerDay.objects.exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_changing_payment_date_invalidates_previous_day(snapshot):
+    day = LedgerDay.getDay(snapshot.payment_date)
+    PaidOrdersGroupedExporter().buildSnapshots([day + timedelta(days=1)])
+
+    snapshot.payment_date = None
+    snapshot.save()
+
+    assert not LedgerDay.objects.filter(day=day).exists()
+    assert LedgerDay.objects.filter(day=day + timedelta(days=1)).exists()
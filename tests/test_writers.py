@@ -0,0 +1,52 @@
+import pytest
+from pretix_itkexport.exporters import (
+    EventExporter, PaidOrdersExporter, PaidOrdersGroupedExporter,
+    PaidOrdersLineExporter,
+)
+from pretix_itkexport.writers import ArrowWriter
+
+pyarrow = pytest.importorskip('pyarrow')
+parquet = pytest.importorskip('pyarrow.parquet')
+
+
+def read(path, output_format):
+    if 'parquet' == output_format:
+        return parquet.read_table(str(path))
+    with pyarrow.OSFile(str(path), 'rb') as source:
+        return pyarrow.ipc.open_file(source).read_all()
+
+
+@pytest.mark.parametrize('exporter_class', [PaidOrdersLineExporter, PaidOrdersGroupedExporter])
+@pytest.mark.parametrize('output_format', ArrowWriter.formats)
+def test_ledger_lines_are_written(create_orders, tmpdir, exporter_class, output_format):
+    benchmark = create_orders(50)
+    data = list(exporter_class().getData(starttime=benchmark.starttime, endtime=benchmark.endtime))
+    path = tmpdir.join('ledger.' + output_format)
+
+    with open(str(path), 'wb') as output:
+        assert ArrowWriter(output, output_format, batch_size=7).write(data) == len(data) - 1
+    table = read(path, output_format)
+
+    assert len(data) - 1 > 7
+    assert table.num_rows == len(data) - 1
+    assert table.column_names == list(data[0])
+    amount = table.schema.field(data[0][PaidOrdersExporter.index_amount])
+    assert amount.type == pyarrow.decimal128(18, 2)
+    assert sum(table.column(amount.name).to_pylist()) == sum(line.amount for line in data[1:])
+
+
+@pytest.mark.parametrize('output_format', ArrowWriter.formats)
+def test_events_are_written(create_orders, tmpdir, output_format):
+    benchmark = create_orders(50, number_of_events=10)
+    data = EventExporter().getData(starttime=benchmark.starttime, endtime=benchmark.endtime)
+    path = tmpdir.join('events.' + output_format)
+
+    with open(str(path), 'wb') as output:
+        assert ArrowWriter(output, output_format, batch_size=3).write(data) == len(data)
+    table = read(path, output_format)
+
+    assert len(data) > 3
+    assert table.num_rows == len(data)
+    assert table.schema.field('revenue').type == pyarrow.decimal128(18, 2)
+    assert table.schema.field('datetime').type == pyarrow.timestamp('us', tz='UTC')
+    assert table.column('datetime').to_pylist() == [row['datetime'] for row in data]